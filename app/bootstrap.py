@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+
+from app.bot.handlers_operator import operator_router
+from app.bot.handlers_user import user_router
+from app.cache_bus import CacheBus
+from app.config import settings
+from app.db import engine, get_session, init_db
+from app.leader import LeaderCallback, LeaderLease
+from app.metrics import instrument_bot, observe_ticket_change
+from app.runtime import bot_session
+from app.services.board import LiveBoard
+from app.services.event_log import EventLog
+from app.services.notify import notifier
+from app.services.queue import (
+    add_ticket_listener,
+    ensure_base_queues,
+    invalidate_queues,
+    remove_ticket_listener,
+    set_queues_publisher,
+)
+from app.services.queue_mirror import QueueMirror, start_queue_mirror, stop_queue_mirror
+from app.services.retention import RetentionJob, start_retention
+from app.services.rubitime import RubitimeSync, start_rubitime_sync
+from app.services.sweeper import CalledSweeper, start_sweeper
+from app.services.wait_estimate import wait_estimator
+
+
+class Runtime:
+    """
+    Общий старт/останов для webhook_app и polling (app.main): БД и миграции, Redis, бот,
+    диспетчер с FSM в Redis, уведомления, метрики, сброс кэшей между процессами, зеркало очереди
+    и лидер, который ведёт фоновые задачи по БД. Режим добавляет к лидерству своё (on_elected)
+    и свой способ получать апдейты.
+    """
+
+    def __init__(self):
+        self.redis = Redis.from_url(settings.REDIS_URL)
+        self.bot = Bot(token=settings.BOT_TOKEN, session=bot_session())
+        self.dp = Dispatcher(storage=RedisStorage(redis=self.redis))
+        self.dp.include_router(user_router)
+        self.dp.include_router(operator_router)
+        self.cache_bus = CacheBus(self.redis)
+        self.leader = LeaderLease(self.redis, "app", ttl=settings.LEADER_TTL)
+        # публикуют переходы все процессы, снимок держат только те, кто отдаёт табло (webhook_app)
+        self.board = LiveBoard(
+            self.redis,
+            interval=settings.BOARD_INTERVAL,
+            resync_interval=settings.BOARD_RESYNC,
+            next_count=settings.BOARD_NEXT,
+            max_clients=settings.BOARD_MAX_CLIENTS,
+        )
+        self.event_log = EventLog(interval=settings.EVENT_LOG_INTERVAL, batch_size=settings.EVENT_LOG_BATCH)
+        self.queue_mirror: Optional[QueueMirror] = None
+        self.retention: Optional[RetentionJob] = None
+        self.sweeper: Optional[CalledSweeper] = None
+        self.rubitime: Optional[RubitimeSync] = None
+
+        self.leader.on_elected(self._start_jobs)
+        self.leader.on_demoted(self._stop_jobs)
+
+    def on_elected(self, callback: LeaderCallback) -> None:
+        """
+        Дополнительное действие лидера; регистрировать до start().
+        """
+        self.leader.on_elected(callback)
+
+    async def start(self) -> None:
+        # миграции и начальные трассы — по одному процессу за раз (несколько workers/реплик стартуют вместе)
+        async with self.redis.lock("rq:lock:startup", timeout=300, blocking_timeout=300):
+            await init_db()
+            async with get_session() as session:
+                await ensure_base_queues(session)
+
+        async with get_session() as session:
+            await wait_estimator.rebuild(session, settings.WAIT_HISTORY)
+
+        instrument_bot(self.bot)
+        add_ticket_listener(observe_ticket_change)
+        add_ticket_listener(wait_estimator.on_ticket_change)
+        add_ticket_listener(self.board.publish_change)
+        add_ticket_listener(self.event_log.on_ticket_change)
+        self.event_log.start()
+
+        self.cache_bus.register("queues", invalidate_queues)
+        set_queues_publisher(lambda: self.cache_bus.publish("queues"))
+        self.cache_bus.start()
+
+        if settings.QUEUE_ENGINE == "redis":
+            self.queue_mirror = await start_queue_mirror(self.redis, resync_interval=settings.QUEUE_MIRROR_RESYNC)
+
+        notifier.start(self.bot)
+        await self.leader.start()
+
+    async def stop(self) -> None:
+        await self.leader.stop()
+        await notifier.stop()
+        await self.board.stop()
+        if self.queue_mirror:
+            await stop_queue_mirror(self.queue_mirror)
+            self.queue_mirror = None
+        set_queues_publisher(None)
+        await self.cache_bus.stop()
+        remove_ticket_listener(self.event_log.on_ticket_change)
+        await self.event_log.stop()
+        remove_ticket_listener(self.board.publish_change)
+        remove_ticket_listener(wait_estimator.on_ticket_change)
+        remove_ticket_listener(observe_ticket_change)
+        await self.bot.session.close()
+        await self.redis.aclose()
+        await engine.dispose()
+
+    async def _start_jobs(self) -> None:
+        self.retention = start_retention()
+        self.sweeper = start_sweeper()
+        self.rubitime = start_rubitime_sync()
+
+    async def _stop_jobs(self) -> None:
+        if self.rubitime:
+            await self.rubitime.stop()
+            self.rubitime = None
+        if self.sweeper:
+            await self.sweeper.stop()
+            self.sweeper = None
+        if self.retention:
+            await self.retention.stop()
+            self.retention = None
+
+    def stats(self) -> dict:
+        body = {
+            "leader": self.leader.is_leader,
+            "notify": notifier.stats(),
+            "events": self.event_log.stats(),
+            "wait": wait_estimator.stats(),
+        }
+        if self.board.running:
+            body["board"] = self.board.stats()
+        if self.retention:
+            body["retention"] = self.retention.stats()
+        if self.sweeper:
+            body["sweeper"] = self.sweeper.stats()
+        if self.rubitime:
+            body["rubitime"] = self.rubitime.stats()
+        return body
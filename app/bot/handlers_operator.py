@@ -1,30 +1,49 @@
 from datetime import date
-from io import BytesIO
 
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery
 
-import qrcode
-
-from app.bot.keyboards import operator_main_kb
+from app.bot.keyboards import operator_main_kb, operator_list_more_kb
 from app.config import settings
 from app.db import get_session
-from app.models import TgUser
-from app.services.queue import call_next, list_waiting, mark_no_show, serve_confirmed, day_stats
+from app.metrics import instrument_router
+from app.models import QueueState, TgUser
+from app.services.notify import notifier, notify_called, notify_positions
+from app.services.queue import (
+    call_next,
+    day_stats,
+    list_waiting_with_names,
+    mark_no_show,
+    serve_confirmed,
+    create_queue,
+    list_queues,
+    queue_depths,
+    queue_label,
+    set_confirm_ttl,
+    set_queue_state,
+)
 
 operator_router = Router(name="operator")
+instrument_router(operator_router)
+
+LIST_PAGE_SIZE = 30
 
 
 def is_operator(tg_user_id: int) -> bool:
-    return tg_user_id in settings.operator_id_set()
+    return tg_user_id in settings.operator_ids
+
 
+def _fmt_minutes(seconds: float | None) -> str:
+    return "—" if seconds is None else f"{seconds / 60:.1f} мин"
 
-def make_qr_png_bytes(payload: str) -> bytes:
-    img = qrcode.make(payload)
-    bio = BytesIO()
-    img.save(bio, format="PNG")
-    return bio.getvalue()
+
+def format_stats(s: dict) -> str:
+    return (
+        f"встали={s['created']}, подтвердили(QR)={s['confirmed']}, завершено={s['served']}, "
+        f"не явились={s['no_show']}, вышли={s['canceled']}, "
+        f"ожидание≈{_fmt_minutes(s['avg_wait_sec'])}, до QR≈{_fmt_minutes(s['avg_confirm_sec'])}"
+    )
 
 
 @operator_router.message(Command("op"))
@@ -32,24 +51,112 @@ async def op_menu(message: Message):
     if not is_operator(message.from_user.id):
         await message.answer("Нет доступа.")
         return
-    await message.answer("Операторское меню:", reply_markup=operator_main_kb())
+    async with get_session() as session:
+        queues = await list_queues(session)
+    await message.answer("Операторское меню:", reply_markup=operator_main_kb(queues))
 
 
 @operator_router.message(Command("stats"))
-async def op_stats(message: Message):
+async def op_stats(message: Message, command: CommandObject):
     if not is_operator(message.from_user.id):
         await message.answer("Нет доступа.")
         return
-    with get_session() as session:
-        s1 = day_stats(session, day=date.today(), queue_id=1)
-        s2 = day_stats(session, day=date.today(), queue_id=2)
-        total = day_stats(session, day=date.today(), queue_id=None)
-    await message.answer(
-        "Статистика за сегодня:\n"
-        f"Трасса 1: встали={s1['created']}, подтвердили(QR)={s1['confirmed']}\n"
-        f"Трасса 2: встали={s2['created']}, подтвердили(QR)={s2['confirmed']}\n"
-        f"Итого: встали={total['created']}, подтвердили(QR)={total['confirmed']}"
-    )
+
+    # /stats | /stats 2026-05-01 | /stats 2026-05-01 2026-05-03
+    try:
+        days = [date.fromisoformat(x) for x in (command.args or "").split()[:2]]
+    except ValueError:
+        await message.answer("Формат: /stats [YYYY-MM-DD [YYYY-MM-DD]]")
+        return
+    day_from = days[0] if days else date.today()
+    day_to = days[1] if len(days) > 1 else day_from
+
+    async with get_session() as session:
+        stats = await day_stats(session, day=day_from, day_to=day_to)
+
+    if day_from == day_to == date.today():
+        title = "Статистика за сегодня:"
+    elif day_from == day_to:
+        title = f"Статистика за {day_from.isoformat()}:"
+    else:
+        title = f"Статистика за {day_from.isoformat()} — {day_to.isoformat()}:"
+    lines = [title]
+    for queue_id, s in sorted(stats["queues"].items()):
+        lines.append(f"{queue_label(queue_id)}: {format_stats(s)}")
+    lines.append(f"Итого: {format_stats(stats['total'])}")
+    await message.answer("\n".join(lines))
+
+
+QUEUE_STATES = {"open": QueueState.OPEN, "pause": QueueState.PAUSED, "close": QueueState.CLOSED}
+STATE_NAMES = {QueueState.OPEN: "открыта", QueueState.PAUSED: "пауза", QueueState.CLOSED: "закрыта"}
+
+
+@operator_router.message(Command("queue"))
+async def op_queue(message: Message, command: CommandObject):
+    if not is_operator(message.from_user.id):
+        await message.answer("Нет доступа.")
+        return
+
+    # /queue | /queue add <название> | /queue open|pause|close <id>
+    action, _, rest = (command.args or "").strip().partition(" ")
+    rest = rest.strip()
+
+    async with get_session() as session:
+        if not action:
+            queues = await list_queues(session)
+            lines = [f"#{q.id} {q.title} — {STATE_NAMES[q.state]}" for q in queues]
+            await message.answer("Трассы:\n" + "\n".join(lines) if lines else "Трасс нет.")
+            return
+
+        if action == "add" and rest:
+            queue = await create_queue(session, rest)
+            await message.answer(f"Создана трасса #{queue.id} «{queue.title}».")
+            return
+
+        state = QUEUE_STATES.get(action)
+        if state is None or not rest.isdigit():
+            await message.answer("Формат: /queue [add <название> | open|pause|close <id>]")
+            return
+        queue_id = int(rest)
+
+        if state == QueueState.CLOSED:
+            active = sum(n for (qid, _), n in (await queue_depths(session)).items() if qid == queue_id)
+            if active:
+                await message.answer(
+                    f"{queue_label(queue_id)}: ещё {active} активных записей. Поставьте на паузу и обслужите очередь."
+                )
+                return
+
+        queue = await set_queue_state(session, queue_id, state)
+    if queue is None:
+        await message.answer(f"Трасса #{queue_id} не найдена.")
+        return
+    await message.answer(f"{queue.title}: {STATE_NAMES[queue.state]}.")
+
+
+@operator_router.message(Command("ttl"))
+async def op_ttl(message: Message, command: CommandObject):
+    if not is_operator(message.from_user.id):
+        await message.answer("Нет доступа.")
+        return
+
+    # /ttl <queue_id> <минуты> | /ttl <queue_id> — вернуть срок по умолчанию
+    try:
+        args = [int(x) for x in (command.args or "").split()[:2]]
+        queue_id, minutes = args[0], (args[1] if len(args) > 1 else None)
+        if minutes is not None and minutes <= 0:
+            raise ValueError
+    except (ValueError, IndexError):
+        await message.answer("Формат: /ttl <трасса> [минуты]")
+        return
+
+    async with get_session() as session:
+        ok = await set_confirm_ttl(session, queue_id, minutes)
+    if not ok:
+        await message.answer(f"{queue_label(queue_id)} не найдена.")
+        return
+    shown = minutes if minutes is not None else f"{settings.CONFIRM_TTL_MIN} (по умолчанию)"
+    await message.answer(f"{queue_label(queue_id)}: QR вызванного действует {shown} мин.")
 
 
 @operator_router.callback_query(F.data.startswith("op:"))
@@ -59,66 +166,70 @@ async def op_actions(cb: CallbackQuery):
         return
 
     try:
-        _, action, queue_id_s = cb.data.split(":")
+        # op:<action>:<queue_id>[:<args>...]
+        _, action, queue_id_s, *args = cb.data.split(":")
         queue_id = int(queue_id_s)
     except Exception:
         await cb.answer("Некорректная кнопка", show_alert=True)
         return
 
     if action == "list":
-        with get_session() as session:
-            tickets = list_waiting(session, queue_id=queue_id, limit=30)
-            if not tickets:
-                await cb.message.answer(f"Трасса {queue_id}: очередь пустая.")
-                await cb.answer()
-                return
-            lines = []
-            for i, t in enumerate(tickets, start=1):
-                u = session.get(TgUser, t.user_id)
-                name = (u.full_name if u else "unknown").strip() or "Без имени"
-                lines.append(f"{i}. #{t.id} — {name}")
-        await cb.message.answer(f"Трасса {queue_id}: первые {len(lines)} ожидающих:\n" + "\n".join(lines))
+        # op:list:<queue_id>[:<after_ticket_id>:<next_index>]
+        after_id = int(args[0]) if args else None
+        start = int(args[1]) if len(args) > 1 else 1
+        async with get_session() as session:
+            rows = await list_waiting_with_names(
+                session, queue_id=queue_id, limit=LIST_PAGE_SIZE + 1, after_ticket_id=after_id
+            )
+        if not rows:
+            await cb.message.answer(f"{queue_label(queue_id)}: очередь пустая." if after_id is None else f"{queue_label(queue_id)}: больше ожидающих нет.")
+            await cb.answer()
+            return
+        has_more = len(rows) > LIST_PAGE_SIZE
+        rows = rows[:LIST_PAGE_SIZE]
+        lines = [
+            f"{i}. #{t.id} — {name.strip() or 'Без имени'}"
+            for i, (t, name) in enumerate(rows, start=start)
+        ]
+        await cb.message.answer(
+            f"{queue_label(queue_id)}: ожидающие {start}–{start + len(lines) - 1}:\n" + "\n".join(lines),
+            reply_markup=operator_list_more_kb(queue_id, rows[-1][0].id, start + len(lines)) if has_more else None,
+        )
         await cb.answer()
         return
 
     if action == "next":
-        with get_session() as session:
-            t = call_next(session, queue_id=queue_id)
+        async with get_session() as session:
+            t = await call_next(session, queue_id=queue_id, operator_tg_id=cb.from_user.id)
             if not t:
-                await cb.message.answer(f"Трасса {queue_id}: очередь пустая.")
+                await cb.message.answer(f"{queue_label(queue_id)}: очередь пустая.")
                 await cb.answer()
                 return
-            user = session.get(TgUser, t.user_id)
-
-        await cb.message.answer(f"Трасса {queue_id}: вызван ticket #{t.id}.")
-
-        if user and t.confirm_token:
-            payload = f"q:{t.id}:{t.confirm_token}"
-            png = make_qr_png_bytes(payload)
-            photo = BufferedInputFile(png, filename=f"ticket_{t.id}.png")
-            await cb.bot.send_photo(
-                chat_id=user.tg_chat_id,
-                photo=photo,
-                caption=f"Вас вызывают на Трасса {queue_id}! Покажите QR оператору для подтверждения.",
-            )
+            user = await session.get(TgUser, t.user_id)
+
+        await cb.message.answer(f"{queue_label(queue_id)}: вызван ticket #{t.id}.")
+
+        if user:
+            await notify_called(t, user.tg_chat_id)
+        notifier.spawn(notify_positions(queue_id))
 
         await cb.answer()
         return
 
     if action == "noshow":
-        with get_session() as session:
-            t = mark_no_show(session, queue_id=queue_id)
+        async with get_session() as session:
+            t = await mark_no_show(session, queue_id=queue_id, operator_tg_id=cb.from_user.id)
         await cb.message.answer(
-            f"Трасса {queue_id}: отмечен NO_SHOW для ticket #{t.id}." if t else f"Трасса {queue_id}: нет вызванного (CALLED)."
+            f"{queue_label(queue_id)}: отмечен NO_SHOW для ticket #{t.id}." if t else f"{queue_label(queue_id)}: нет вызванного (CALLED)."
         )
         await cb.answer()
         return
 
     if action == "serve":
-        with get_session() as session:
-            served = serve_confirmed(session, queue_id=queue_id)
+        async with get_session() as session:
+            served = await serve_confirmed(session, queue_id=queue_id, operator_tg_id=cb.from_user.id)
         await cb.message.answer(
-            f"Трасса {queue_id}: завершён ticket #{served.id}." if served else f"Трасса {queue_id}: нет CONFIRMED для завершения."
+            f"{queue_label(queue_id)}: завершён ticket #{served.id}." if served else f"{queue_label(queue_id)}: нет CONFIRMED для завершения."
         )
         await cb.answer()
         return
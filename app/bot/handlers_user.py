@@ -1,58 +1,149 @@
 from aiogram import Router, F
 from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, ReplyKeyboardRemove
 
-from app.bot.keyboards import user_main_kb
+from app.bot.keyboards import booking_contact_kb, user_main_kb
 from app.db import get_session
-from app.services.queue import upsert_user, enqueue, get_active_ticket, position_in_queue, leave
+from app.metrics import instrument_router
+from app.models import TicketStatus
+from app.services.qr import make_qr_png, ticket_qr_payload
+from app.services.rubitime import check_in, find_booking, local_time, normalize_phone
+from app.services.wait_estimate import wait_estimator
+from app.services.queue import (
+    enqueue,
+    get_active_ticket,
+    leave,
+    list_queues,
+    lookup_user,
+    peek_active_ticket,
+    position_in_queue,
+    queue_label,
+    upsert_user,
+)
 
 user_router = Router(name="user")
+instrument_router(user_router)
 
 
 @user_router.message(CommandStart())
 async def start(message: Message):
-    await message.answer("Живая очередь: выберите действие.", reply_markup=user_main_kb())
+    async with get_session() as session:
+        queues = await list_queues(session)
+    await message.answer("Живая очередь: выберите действие.", reply_markup=user_main_kb(queues))
 
 
 @user_router.callback_query(F.data.startswith("u:enq:"))
 async def user_enqueue(cb: CallbackQuery):
     queue_id = int(cb.data.split(":")[2])
-    with get_session() as session:
-        user = upsert_user(session, cb.from_user.id, cb.message.chat.id, cb.from_user.full_name or "")
-        ticket = enqueue(session, queue_id=queue_id, user=user)
+    async with get_session() as session:
+        user = await upsert_user(session, cb.from_user.id, cb.message.chat.id, cb.from_user.full_name or "")
+        ticket = await enqueue(session, queue_id=queue_id, user=user)
 
-        if ticket.status.name == "WAITING":
-            pos = position_in_queue(session, ticket)
-            await cb.message.answer(f"Вы в очереди на Трасса {queue_id}. Ваш номер в ожидании: {pos}.")
+        if ticket is None:
+            await cb.message.answer(f"{queue_label(queue_id)} сейчас не принимает записи.")
+        elif ticket.status.name == "WAITING":
+            pos = await position_in_queue(session, ticket)
+            await cb.message.answer(f"Вы в очереди на {queue_label(queue_id)}. Ваш номер в ожидании: {pos}.")
         else:
-            await cb.message.answer(f"У вас уже есть активная запись (статус: {ticket.status}, Трасса {ticket.queue_id}).")
+            await cb.message.answer(f"У вас уже есть активная запись (статус: {ticket.status}, {queue_label(ticket.queue_id)}).")
 
     await cb.answer()
 
 
 @user_router.callback_query(F.data == "u:pos")
 async def user_position(cb: CallbackQuery):
-    with get_session() as session:
-        user = upsert_user(session, cb.from_user.id, cb.message.chat.id, cb.from_user.full_name or "")
-        ticket = get_active_ticket(session, user.id)
+    async with get_session() as session:
+        user = await lookup_user(session, cb.from_user.id)
+        ticket = await peek_active_ticket(session, user.id) if user else None
         if not ticket:
             await cb.message.answer("У вас нет активной записи.")
             await cb.answer()
             return
 
         if ticket.status.name == "WAITING":
-            pos = position_in_queue(session, ticket)
-            await cb.message.answer(f"Вы ждёте на Трасса {ticket.queue_id}. Позиция: {pos}.")
+            pos = await position_in_queue(session, ticket)
+            minutes = wait_estimator.estimate_minutes(ticket.queue_id, pos)
+            eta = f", ожидание ≈ {minutes} мин" if minutes else ""
+            await cb.message.answer(f"Вы ждёте на {queue_label(ticket.queue_id)}. Позиция: {pos}{eta}.")
         else:
-            await cb.message.answer(f"Ваш статус: {ticket.status} (Трасса {ticket.queue_id}).")
+            await cb.message.answer(f"Ваш статус: {ticket.status} ({queue_label(ticket.queue_id)}).")
 
     await cb.answer()
 
 
+@user_router.callback_query(F.data == "u:qr")
+async def user_qr(cb: CallbackQuery):
+    async with get_session() as session:
+        user = await lookup_user(session, cb.from_user.id)
+        ticket = await peek_active_ticket(session, user.id) if user else None
+
+    if not ticket or ticket.status != TicketStatus.CALLED or not ticket.confirm_token:
+        await cb.answer("QR появится, когда вас вызовут.", show_alert=True)
+        return
+
+    png = await make_qr_png(ticket_qr_payload(ticket))
+    await cb.message.answer_photo(
+        BufferedInputFile(png, filename=f"ticket_{ticket.id}.png"),
+        caption=f"Ваш QR для {queue_label(ticket.queue_id)}. Покажите его оператору.",
+    )
+    await cb.answer()
+
+
 @user_router.callback_query(F.data == "u:leave")
 async def user_leave(cb: CallbackQuery):
-    with get_session() as session:
-        user = upsert_user(session, cb.from_user.id, cb.message.chat.id, cb.from_user.full_name or "")
-        ok = leave(session, user)
+    async with get_session() as session:
+        user = await upsert_user(session, cb.from_user.id, cb.message.chat.id, cb.from_user.full_name or "")
+        ok = await leave(session, user)
     await cb.message.answer("Вы вышли из очереди." if ok else "У вас нет активной записи.")
     await cb.answer()
+
+
+@user_router.callback_query(F.data == "u:book")
+async def user_booking(cb: CallbackQuery):
+    await cb.message.answer(
+        "Отправьте номер телефона, на который сделана запись в Rubitime.", reply_markup=booking_contact_kb()
+    )
+    await cb.answer()
+
+
+@user_router.message(F.contact)
+async def user_booking_contact(message: Message):
+    """
+    Отметка прибытия по записи: телефон из контакта -> запись на сегодня (локальная таблица booking).
+    """
+    if message.contact.user_id != message.from_user.id:
+        await message.answer("Нужен ваш собственный номер — кнопка «Отправить номер».")
+        return
+
+    async with get_session() as session:
+        user = await upsert_user(session, message.from_user.id, message.chat.id, message.from_user.full_name or "")
+        active = await get_active_ticket(session, user.id)
+        if active:
+            await message.answer(
+                f"У вас уже есть активная запись (статус: {active.status}, {queue_label(active.queue_id)}).",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+            return
+
+        booking = await find_booking(session, normalize_phone(message.contact.phone_number))
+        ticket, checked_in = await check_in(session, booking, user) if booking else (None, False)
+        if ticket is not None and not checked_in:
+            # тикет появился параллельно (повтор контакта, кнопка в другом окне)
+            await message.answer(
+                f"У вас уже есть активная запись (статус: {ticket.status}, {queue_label(ticket.queue_id)}).",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+            return
+        if ticket is None:
+            await message.answer(
+                "Записи на ближайшее время на этот номер не найдено. Можно встать в живую очередь.",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+            return
+        pos = await position_in_queue(session, ticket)
+
+    await message.answer(
+        f"Запись на {local_time(booking.starts_at)} найдена: вы в очереди на {queue_label(ticket.queue_id)}. "
+        f"Позиция: {pos}.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
@@ -1,30 +1,64 @@
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from functools import lru_cache
+from typing import Sequence
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton, ReplyKeyboardMarkup
 from aiogram.types.web_app_info import WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.config import settings
+from app.models import Queue, QueueState
+
+# (id, title, state) — хешируемый снимок трасс: разметка строится один раз на версию реестра
+QueueKey = tuple[tuple[int, str, QueueState], ...]
+
+
+def _key(queues: Sequence[Queue]) -> QueueKey:
+    return tuple((q.id, q.title, q.state) for q in queues if q.state != QueueState.CLOSED)
 
 
-def user_main_kb() -> InlineKeyboardMarkup:
+def user_main_kb(queues: Sequence[Queue]) -> InlineKeyboardMarkup:
+    return _user_main_kb(_key(queues))
+
+
+@lru_cache(maxsize=32)
+def _user_main_kb(queues: QueueKey) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
-    kb.button(text="Встать в очередь (Трасса 1)", callback_data="u:enq:1")
-    kb.button(text="Встать в очередь (Трасса 2)", callback_data="u:enq:2")
+    for queue_id, title, state in queues:
+        suffix = " — пауза" if state == QueueState.PAUSED else ""
+        kb.button(text=f"Встать в очередь ({title}){suffix}", callback_data=f"u:enq:{queue_id}")
+    if settings.rubitime_enabled:
+        kb.button(text="У меня запись", callback_data="u:book")
     kb.button(text="Моё место", callback_data="u:pos")
+    kb.button(text="Мой QR", callback_data="u:qr")
     kb.button(text="Выйти из очереди", callback_data="u:leave")
     kb.adjust(1)
     return kb.as_markup()
 
 
-def operator_main_kb() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=1)
+def booking_contact_kb() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="Отправить номер", request_contact=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+
+
+def operator_main_kb(queues: Sequence[Queue]) -> InlineKeyboardMarkup:
+    return _operator_main_kb(_key(queues))
+
+
+@lru_cache(maxsize=32)
+def _operator_main_kb(queues: QueueKey) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
-    kb.button(text="Трасса 1: Следующий", callback_data="op:next:1")
-    kb.button(text="Трасса 2: Следующий", callback_data="op:next:2")
-    kb.button(text="Трасса 1: Список (30)", callback_data="op:list:1")
-    kb.button(text="Трасса 2: Список (30)", callback_data="op:list:2")
-    kb.button(text="Трасса 1: Не явился", callback_data="op:noshow:1")
-    kb.button(text="Трасса 2: Не явился", callback_data="op:noshow:2")
-    kb.button(text="Трасса 1: Завершить (SERVED)", callback_data="op:serve:1")
-    kb.button(text="Трасса 2: Завершить (SERVED)", callback_data="op:serve:2")
+    for action, label in (
+        ("next", "Следующий"),
+        ("list", "Список (30)"),
+        ("noshow", "Не явился"),
+        ("serve", "Завершить (SERVED)"),
+    ):
+        for queue_id, title, _ in queues:
+            kb.button(text=f"{title}: {label}", callback_data=f"op:{action}:{queue_id}")
 
     kb.row(
         InlineKeyboardButton(
@@ -34,3 +68,9 @@ def operator_main_kb() -> InlineKeyboardMarkup:
     )
     kb.adjust(1)
     return kb.as_markup()
+
+
+def operator_list_more_kb(queue_id: int, after_ticket_id: int, next_index: int) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="Дальше", callback_data=f"op:list:{queue_id}:{after_ticket_id}:{next_index}")
+    return kb.as_markup()
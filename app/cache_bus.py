@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "rq:invalidate"
+
+
+class CacheBus:
+    """
+    Сброс in-memory кэшей во всех процессах/репликах через Redis pub/sub.
+    Сообщение — имя кэша; подписчик вызывает зарегистрированный для него сброс.
+    Потерянное сообщение не страшно: кэши всё равно живут ограниченный TTL.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._handlers: dict[str, Callable[[], None]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, invalidate: Callable[[], None]) -> None:
+        self._handlers[name] = invalidate
+
+    async def publish(self, name: str) -> None:
+        await self.redis.publish(CHANNEL, name)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._listen(), name="cache-bus")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                # переподписка: за время разрыва могли пропустить сообщения
+                for invalidate in self._handlers.values():
+                    invalidate()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    name = message["data"].decode() if isinstance(message["data"], bytes) else message["data"]
+                    handler = self._handlers.get(name)
+                    if handler:
+                        handler()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("cache bus disconnected, resubscribing")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
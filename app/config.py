@@ -1,4 +1,5 @@
 from __future__ import annotations
+from functools import cached_property
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,24 +7,156 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
     APP_MODE: str = "webhook"
+    # polling: порт для /metrics (0 — не поднимать); в webhook-режиме /metrics отдаёт FastAPI
+    METRICS_PORT: int = 0
 
     BOT_TOKEN: str
     BASE_URL: str
     WEBHOOK_PATH: str = "/tg/webhook"
     WEBHOOK_SECRET: str = ""
+    # свой Bot API сервер (локальный telegram-bot-api или заглушка из bench/load.py); пусто — api.telegram.org
+    TELEGRAM_API_URL: str = ""
+
+    # фоновая обработка апдейтов (webhook и polling): 0 — webhook обрабатывает апдейт прямо в запросе
+    UPDATE_WORKERS: int = 8
+    UPDATE_QUEUE_SIZE: int = 1000
+    # сколько помнить принятый update_id (отсев повторной доставки Telegram), секунды
+    UPDATE_DEDUP_TTL: int = 3600
+
+    # сколько процессов всего (uvicorn workers × реплики) — на них делится NOTIFY_GLOBAL_RATE
+    APP_INSTANCES: int = 1
+    # регистрация webhook и фоновые задачи по БД — только в процессе-лидере (аренда в Redis), секунды
+    LEADER_TTL: float = 15.0
+
+    # polling: long-poll getUpdates (Telegram отвечает сразу, как появится апдейт) и размер пачки
+    POLL_TIMEOUT: int = 25
+    POLL_LIMIT: int = 100
+
+    # исходящие уведомления: лимиты Bot API и сколько ожидающих оповещать о сдвиге очереди
+    NOTIFY_GLOBAL_RATE: float = 25.0
+    NOTIFY_CHAT_INTERVAL: float = 1.0
+    NOTIFY_CONCURRENCY: int = 8
+    NOTIFY_AHEAD: int = 3
+
+    # сколько секунд держать TgUser в памяти, прежде чем сверить с БД
+    USER_CACHE_TTL: float = 60.0
 
     OPERATOR_IDS: str = ""
 
     DB_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
     REDIS_URL: str = "redis://redis:6379/0"
+    # sql — все чтения очереди из БД; redis — позиции/списки из зеркала в Redis (БД остаётся источником правды)
+    QUEUE_ENGINE: str = "sql"
+    QUEUE_MIRROR_RESYNC: float = 300.0
+
+    # трассы, создаваемые при пустой таблице queue (через запятую); дальше — команда /queue
+    DEFAULT_QUEUES: str = "Трасса 1,Трасса 2"
+    # как часто перечитывать реестр трасс (изменения, сделанные другими репликами), секунды
+    QUEUE_REGISTRY_TTL: float = 30.0
+
+    # срок QR вызванного по умолчанию (у трассы может быть свой, Queue.confirm_ttl_min)
+    CONFIRM_TTL_MIN: int = 15
+    # фоновая отметка NO_SHOW для CALLED с истёкшим QR (0 — выключена); AUTO_CALL — сразу вызывать следующего
+    SWEEP_INTERVAL: float = 30.0
+    SWEEP_BATCH: int = 100
+    SWEEP_AUTO_CALL: bool = False
+
+    # завершённые тикеты старше RETENTION_DAYS переносятся в ticketarchive; 0 — не переносить
+    RETENTION_DAYS: int = 30
+    RETENTION_INTERVAL: float = 3600.0
+    RETENTION_BATCH: int = 1000
+
+    # журнал переходов тикетов (ticketevent): пишется пачками не реже раза в EVENT_LOG_INTERVAL секунд
+    EVENT_LOG_INTERVAL: float = 1.0
+    EVENT_LOG_BATCH: int = 500
+    # Bearer-токен для выгрузки журнала (GET /api/events.csv); пусто — выгрузка выключена
+    EXPORT_TOKEN: str = ""
+
+    # прогноз ожидания в «Моё место»: вес нового тикета в EWMA и сколько последних тикетов трассы читать при старте
+    WAIT_EWMA_ALPHA: float = 0.2
+    WAIT_HISTORY: int = 50
+
+    # публичное табло (/board, /board/stream): как часто рассылать новую версию, сверка с БД (секунды),
+    # сколько следующих номеров показывать и предел SSE-подключений на процесс
+    BOARD_INTERVAL: float = 0.5
+    BOARD_RESYNC: float = 60.0
+    BOARD_NEXT: int = 5
+    BOARD_MAX_CLIENTS: int = 5000
+
+    # записи из Rubitime (app.services.rubitime); пустой RUBITIME_KEY — интеграция выключена
+    RUBITIME_KEY: str = ""
+    RUBITIME_URL: str = "https://rubitime.ru/api2"
+    # метод API со списком записей за период (POST, фильтр updated_from для дельты)
+    RUBITIME_RECORDS_METHOD: str = "get-records"
+    # cooperator_id Rubitime -> id трассы: "101:1,102:2"; записи других сотрудников не берём
+    RUBITIME_QUEUE_MAP: str = ""
+    # часовой пояс времени в Rubitime (у нас в БД — naive UTC)
+    RUBITIME_TZ: str = "Europe/Moscow"
+    # коды статусов Rubitime, означающие отмену записи (через запятую)
+    RUBITIME_CANCELED_STATUSES: str = "4"
+    RUBITIME_SYNC_INTERVAL: float = 60.0
+    RUBITIME_TIMEOUT: float = 10.0
+    RUBITIME_PAGE_SIZE: int = 500
+    # отметиться по записи можно за EARLY минут до её времени и до LATE минут после
+    RUBITIME_CHECKIN_EARLY_MIN: int = 60
+    RUBITIME_CHECKIN_LATE_MIN: int = 30
 
     WEBAPP_SCANNER_PATH: str = "/webapp/scanner"
+    # максимальный возраст initData (auth_date) для /api/confirm, секунды
+    WEBAPP_AUTH_MAX_AGE: int = 86400
+    # сколько токенов принимает /api/confirm/batch за раз
+    CONFIRM_BATCH_MAX: int = 200
+    # scanner.html читается в память при старте; DEV_RELOAD — перечитывать при изменении файла
+    WEBAPP_CACHE_MAX_AGE: int = 300
+    WEBAPP_DEV_RELOAD: bool = False
+
+    # matrix — свой PNG-энкодер без PIL (быстрее), pil — через qrcode.make_image
+    QR_RENDERER: str = "matrix"
 
-    def operator_id_set(self) -> set[int]:
+    @cached_property
+    def operator_ids(self) -> frozenset[int]:
+        """
+        OPERATOR_IDS разбирается один раз; is_operator вызывается на каждом апдейте оператора.
+        """
         raw = (self.OPERATOR_IDS or "").strip()
         if not raw:
-            return set()
-        return {int(x.strip()) for x in raw.split(",") if x.strip()}
+            return frozenset()
+        return frozenset(int(x.strip()) for x in raw.split(",") if x.strip())
+
+    @property
+    def rubitime_enabled(self) -> bool:
+        return bool(self.RUBITIME_KEY)
+
+    @cached_property
+    def rubitime_queue_map(self) -> dict[int, int]:
+        pairs = (p.split(":", 1) for p in self.RUBITIME_QUEUE_MAP.split(",") if ":" in p)
+        return {int(cooperator.strip()): int(queue_id.strip()) for cooperator, queue_id in pairs}
+
+    @cached_property
+    def rubitime_canceled_statuses(self) -> frozenset[str]:
+        return frozenset(s.strip() for s in self.RUBITIME_CANCELED_STATUSES.split(",") if s.strip())
+
+    @property
+    def default_queue_titles(self) -> list[str]:
+        return [t.strip() for t in self.DEFAULT_QUEUES.split(",") if t.strip()]
+
+    def operator_id_set(self) -> frozenset[int]:
+        return self.operator_ids
+
+    @property
+    def async_db_url(self) -> str:
+        """
+        DB_URL в async-драйвер: sqlite -> aiosqlite, postgresql -> asyncpg.
+        """
+        url = self.DB_URL
+        if url.startswith("sqlite:"):
+            return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+        for prefix in ("postgresql+psycopg2:", "postgresql+psycopg:", "postgresql:", "postgres:"):
+            if url.startswith(prefix):
+                return "postgresql+asyncpg:" + url[len(prefix):]
+        return url
 
     @property
     def webhook_url(self) -> str:
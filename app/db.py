@@ -1,10 +1,54 @@
-from sqlmodel import SQLModel, Session, create_engine
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
 from app.config import settings
 
-engine = create_engine(settings.DB_URL, pool_pre_ping=True)
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# ревизия, соответствующая схеме, которую до миграций создавал create_all
+BASELINE_REVISION = "0001"
+
+
+def _engine_kwargs() -> dict:
+    kwargs: dict = {"pool_pre_ping": True}
+    if not settings.async_db_url.startswith("sqlite"):
+        kwargs["pool_size"] = settings.DB_POOL_SIZE
+        kwargs["max_overflow"] = settings.DB_MAX_OVERFLOW
+    return kwargs
+
+
+engine = create_async_engine(settings.async_db_url, **_engine_kwargs())
+
+# expire_on_commit=False: хендлеры читают поля тикета уже после закрытия сессии
+session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def alembic_config(connection: Connection | None = None) -> Config:
+    cfg = Config()
+    cfg.set_main_option("script_location", str(MIGRATIONS_DIR))
+    if connection is not None:
+        cfg.attributes["connection"] = connection
+    return cfg
+
+
+def _migrate(connection: Connection) -> None:
+    cfg = alembic_config(connection)
+    tables = set(inspect(connection).get_table_names())
+    if "ticket" in tables and "alembic_version" not in tables:
+        # база создана ещё через create_all — помечаем её baseline и докатываем остальное
+        command.stamp(cfg, BASELINE_REVISION)
+    command.upgrade(cfg, "head")
+
+
+async def init_db() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(_migrate)
 
-def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
 
-def get_session() -> Session:
-    return Session(engine)
+def get_session() -> AsyncSession:
+    return session_factory()
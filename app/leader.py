@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+LeaderCallback = Callable[[], Awaitable[None]]
+
+# максимальная пауза между повторами упавшего on_elected
+RETRY_MAX = 60.0
+
+# продлить аренду, только если она всё ещё наша
+_RENEW = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLease:
+    """
+    Лидер среди процессов/реплик: ключ в Redis с TTL (SET NX PX), который лидер продлевает
+    каждые ttl/3. Если лидер умер, через ttl аренду подхватывает другой процесс.
+
+    on_elected вызывается при получении лидерства, on_demoted — при потере (в т.ч. при stop):
+    так запускаются работы, которые должны идти в одном экземпляре (регистрация webhook,
+    фоновые задачи по БД). Упавший on_elected повторяется, пока процесс лидер, с растущей
+    паузой (от ttl/3 до RETRY_MAX); колбэки должны быть идемпотентны.
+    """
+
+    def __init__(self, redis: Redis, name: str, ttl: float = 15.0):
+        self.redis = redis
+        self.key = f"rq:leader:{name}"
+        self.ttl = ttl
+        self.token = uuid4().hex
+        self.is_leader = False
+        self._on_elected: list[LeaderCallback] = []
+        self._on_demoted: list[LeaderCallback] = []
+        # on_elected, которые ещё не отработали в текущем лидерстве
+        self._pending: list[LeaderCallback] = []
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def on_elected(self, callback: LeaderCallback) -> None:
+        self._on_elected.append(callback)
+
+    def on_demoted(self, callback: LeaderCallback) -> None:
+        self._on_demoted.append(callback)
+
+    async def start(self) -> None:
+        # первая попытка синхронно: к концу старта процесс уже знает, лидер ли он
+        await self._tick()
+        self._task = asyncio.create_task(self._loop(), name=f"leader-{self.key}")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            await self._set_leader(False)
+            try:
+                await self.redis.eval(_RELEASE, 1, self.key, self.token)
+            except Exception:
+                logger.exception("leader %s: release failed", self.key)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._tick()
+
+    async def _tick(self) -> None:
+        ttl_ms = int(self.ttl * 1000)
+        try:
+            if self.is_leader:
+                held = bool(await self.redis.eval(_RENEW, 1, self.key, self.token, ttl_ms))
+            else:
+                held = bool(await self.redis.set(self.key, self.token, nx=True, px=ttl_ms))
+        except Exception:
+            # без Redis не можем подтвердить аренду — безопаснее считать себя не лидером
+            logger.exception("leader %s: redis unavailable", self.key)
+            held = False
+        if held != self.is_leader:
+            await self._set_leader(held)
+        elif self.is_leader and self._pending and time.monotonic() >= self._retry_at:
+            await self._run_elected()
+
+    async def _set_leader(self, value: bool) -> None:
+        self.is_leader = value
+        logger.info("leader %s: %s", self.key, "elected" if value else "demoted")
+        if value:
+            self._pending = list(self._on_elected)
+            self._retry_delay = 0.0
+            await self._run_elected()
+            return
+        self._pending = []
+        for callback in self._on_demoted:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("leader %s: callback %r failed", self.key, callback)
+
+    async def _run_elected(self) -> None:
+        failed: list[LeaderCallback] = []
+        for callback in self._pending:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("leader %s: callback %r failed, will retry", self.key, callback)
+                failed.append(callback)
+        self._pending = failed
+        if failed:
+            self._retry_delay = min(max(self._retry_delay * 2, self.ttl / 3), RETRY_MAX)
+            self._retry_at = time.monotonic() + self._retry_delay
@@ -1,34 +1,53 @@
 import asyncio
 import logging
+import signal
 import sys
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
+from prometheus_client import start_http_server
 
-from app.bot.handlers_operator import operator_router
-from app.bot.handlers_user import user_router
-from app.db import init_db, get_session
-from app.services.queue import ensure_base_queues
+from app.bootstrap import Runtime
 from app.config import settings
+from app.polling import Poller
+from app.update_workers import UpdateWorkerPool
 
 
 async def main():
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
-    init_db()
-    with get_session() as session:
-        ensure_base_queues(session)
-
-    bot = Bot(
-        token=settings.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    runtime = Runtime()
+    # webhook снимает сам Poller перед опросом
+    await runtime.start()
+    if settings.METRICS_PORT:
+        # в polling-режиме нет FastAPI — /metrics отдаёт отдельный HTTP-сервер prometheus_client
+        start_http_server(settings.METRICS_PORT)
+
+    pool = UpdateWorkerPool(
+        runtime.dp,
+        runtime.bot,
+        runtime.redis,
+        workers=max(1, settings.UPDATE_WORKERS),
+        queue_size=settings.UPDATE_QUEUE_SIZE,
+        dedup_ttl=settings.UPDATE_DEDUP_TTL,
     )
-    dp = Dispatcher()
-    dp.include_router(user_router)
-    dp.include_router(operator_router)
-
-    await dp.start_polling(bot)
+    pool.start()
+    poller = Poller(
+        runtime.bot,
+        pool,
+        allowed_updates=runtime.dp.resolve_used_update_types(),
+        timeout=settings.POLL_TIMEOUT,
+        limit=settings.POLL_LIMIT,
+        is_leader=lambda: runtime.leader.is_leader,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, poller.stop)
+
+    try:
+        await poller.run()
+    finally:
+        unprocessed = await pool.stop()
+        await poller.confirm(unprocessed)
+        await runtime.stop()
 
 
 if __name__ == "__main__":
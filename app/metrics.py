@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import functools
+import os
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from app.models import TicketStatus
+
+if TYPE_CHECKING:
+    from app.services.queue import TicketChange
+
+# бакеты под интерактивные операции (секунды)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# бакеты под ожидание в очереди (секунды): от минуты до нескольких часов
+WAIT_BUCKETS = (30, 60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200, 10800, 14400)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Время работы хендлера aiogram", ["router", "handler"], buckets=FAST_BUCKETS
+)
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ["router", "handler"])
+
+DB_LATENCY = Histogram(
+    "queue_db_seconds", "Время функций app.services.queue (запросы к БД)", ["op"], buckets=FAST_BUCKETS
+)
+
+WEBHOOK_ACK = Histogram(
+    "webhook_ack_seconds", "От получения webhook до ответа Telegram", ["outcome"], buckets=FAST_BUCKETS
+)
+UPDATE_LAG = Histogram(
+    "update_process_seconds", "От приёма апдейта воркер-пулом до конца обработки", buckets=FAST_BUCKETS
+)
+
+QUEUE_DEPTH = Gauge(
+    "queue_tickets", "Активные тикеты по трассам и статусам", ["queue_id", "status"], multiprocess_mode="livemostrecent"
+)
+TICKET_WAIT = Histogram(
+    "ticket_wait_seconds", "Ожидание: created->called и called->confirmed", ["queue_id", "stage"], buckets=WAIT_BUCKETS
+)
+
+QR_RENDER = Histogram("qr_render_seconds", "Рендер PNG с QR", ["renderer"], buckets=FAST_BUCKETS)
+
+TG_API_LATENCY = Histogram("telegram_api_seconds", "Вызовы Bot API", ["method"], buckets=FAST_BUCKETS)
+TG_API_ERRORS = Counter("telegram_api_errors_total", "Ошибки Bot API", ["method", "kind"])
+TG_RETRY_AFTER = Counter("telegram_retry_after_total", "Ответы 429 (retry_after) от Bot API", ["method"])
+
+
+def timed(op: str):
+    """
+    Декоратор для async-функций сервиса: время вызова в queue_db_seconds{op=...}.
+    """
+    hist = DB_LATENCY.labels(op)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+class HandlerTimer(BaseMiddleware):
+    """
+    Inner-middleware роутера: срабатывает только для хендлера, прошедшего фильтры.
+    """
+
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        obj = data.get("handler")
+        name = getattr(getattr(obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(self.router_name, name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(self.router_name, name).observe(time.perf_counter() - started)
+
+
+def instrument_router(router: Router) -> None:
+    timer = HandlerTimer(router.name)
+    router.message.middleware(timer)
+    router.callback_query.middleware(timer)
+
+
+class TelegramTimer(BaseRequestMiddleware):
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            TG_RETRY_AFTER.labels(name).inc()
+            raise
+        except Exception as e:
+            TG_API_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            TG_API_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+
+def instrument_bot(bot: Bot) -> None:
+    bot.session.middleware(TelegramTimer())
+
+
+async def observe_ticket_change(change: TicketChange) -> None:
+    """
+    Слушатель переходов тикетов (app.services.queue): распределение времени ожидания.
+    """
+    t = change.ticket
+    if change.prev_status == TicketStatus.WAITING and t.status == TicketStatus.CALLED and t.called_at:
+        TICKET_WAIT.labels(str(t.queue_id), "called").observe((t.called_at - t.created_at).total_seconds())
+    elif change.prev_status == TicketStatus.CALLED and t.status == TicketStatus.CONFIRMED and t.confirmed_at and t.called_at:
+        TICKET_WAIT.labels(str(t.queue_id), "confirmed").observe((t.confirmed_at - t.called_at).total_seconds())
+
+
+def set_queue_depths(depths: dict[tuple[int, str], int]) -> None:
+    QUEUE_DEPTH.clear()
+    for (queue_id, status), count in depths.items():
+        QUEUE_DEPTH.labels(str(queue_id), status).set(count)
+
+
+def render_latest() -> tuple[bytes, str]:
+    """
+    При нескольких uvicorn workers метрики пишутся в PROMETHEUS_MULTIPROC_DIR
+    и на /metrics собираются со всех процессов.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,61 @@
+"""baseline: схема, которую раньше создавал SQLModel.metadata.create_all
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+TICKET_STATUS = sa.Enum("WAITING", "CALLED", "CONFIRMED", "SERVED", "CANCELED", "NO_SHOW", name="ticketstatus")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "queue",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=False),
+    )
+    op.create_table(
+        "tguser",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("tg_user_id", sa.Integer(), nullable=False),
+        sa.Column("tg_chat_id", sa.Integer(), nullable=False),
+        sa.Column("full_name", sa.String(), nullable=False),
+    )
+    op.create_index("ix_tguser_tg_user_id", "tguser", ["tg_user_id"], unique=True)
+
+    op.create_table(
+        "ticket",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("queue_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", TICKET_STATUS, nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("called_at", sa.DateTime(), nullable=True),
+        sa.Column("confirmed_at", sa.DateTime(), nullable=True),
+        sa.Column("served_at", sa.DateTime(), nullable=True),
+        sa.Column("canceled_at", sa.DateTime(), nullable=True),
+        sa.Column("no_show_at", sa.DateTime(), nullable=True),
+        sa.Column("confirm_token", sa.String(), nullable=True),
+        sa.Column("confirm_token_expires_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_ticket_queue_id", "ticket", ["queue_id"])
+    op.create_index("ix_ticket_user_id", "ticket", ["user_id"])
+    op.create_index("ix_ticket_status", "ticket", ["status"])
+    op.create_index("ix_ticket_created_at", "ticket", ["created_at"])
+    op.create_index("ix_ticket_confirm_token", "ticket", ["confirm_token"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_table("ticket")
+    op.drop_table("tguser")
+    op.drop_table("queue")
+    TICKET_STATUS.drop(op.get_bind(), checkfirst=True)
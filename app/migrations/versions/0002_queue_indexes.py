@@ -0,0 +1,71 @@
+"""составные и частичные индексы под запросы очереди, один активный тикет на пользователя
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+ACTIVE_WHERE = sa.text("status IN ('WAITING', 'CALLED', 'CONFIRMED')")
+
+
+def _status_where(status: str):
+    return sa.text(f"status = '{status}'")
+
+
+def _partial(name: str, columns: list[str], where, unique: bool = False) -> None:
+    op.create_index(
+        name,
+        "ticket",
+        columns,
+        unique=unique,
+        postgresql_where=where,
+        sqlite_where=where,
+        if_not_exists=True,
+    )
+
+
+def upgrade() -> None:
+    # До уникального индекса: если гонка в старом enqueue оставила у пользователя
+    # несколько активных тикетов, оставляем самый новый, остальные отменяем.
+    op.execute(
+        """
+        UPDATE ticket SET status = 'CANCELED', canceled_at = CURRENT_TIMESTAMP
+        WHERE status IN ('WAITING', 'CALLED', 'CONFIRMED')
+          AND id NOT IN (
+            SELECT MAX(id) FROM ticket
+            WHERE status IN ('WAITING', 'CALLED', 'CONFIRMED')
+            GROUP BY user_id
+          )
+        """
+    )
+
+    op.create_index(
+        "ix_ticket_queue_status_created", "ticket", ["queue_id", "status", "created_at"], if_not_exists=True
+    )
+    _partial("ux_ticket_active_user", ["user_id"], ACTIVE_WHERE, unique=True)
+    _partial("ix_ticket_waiting", ["queue_id", "created_at", "id"], _status_where("WAITING"))
+    _partial("ix_ticket_called", ["queue_id", "called_at", "id"], _status_where("CALLED"))
+    _partial("ix_ticket_confirmed", ["queue_id", "confirmed_at", "id"], _status_where("CONFIRMED"))
+
+    # перекрыты составными индексами выше
+    op.drop_index("ix_ticket_queue_id", table_name="ticket", if_exists=True)
+    op.drop_index("ix_ticket_status", table_name="ticket", if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index("ix_ticket_status", "ticket", ["status"])
+    op.create_index("ix_ticket_queue_id", "ticket", ["queue_id"])
+    op.drop_index("ix_ticket_confirmed", table_name="ticket")
+    op.drop_index("ix_ticket_called", table_name="ticket")
+    op.drop_index("ix_ticket_waiting", table_name="ticket")
+    op.drop_index("ux_ticket_active_user", table_name="ticket")
+    op.drop_index("ix_ticket_queue_status_created", table_name="ticket")
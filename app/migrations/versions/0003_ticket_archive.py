@@ -0,0 +1,48 @@
+"""ticketarchive: завершённые тикеты старше RETENTION_DAYS
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+_STATUSES = ("WAITING", "CALLED", "CONFIRMED", "SERVED", "CANCELED", "NO_SHOW")
+# тип ticketstatus в Postgres уже создан в 0001
+TICKET_STATUS = sa.Enum(*_STATUSES, name="ticketstatus").with_variant(
+    postgresql.ENUM(*_STATUSES, name="ticketstatus", create_type=False), "postgresql"
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ticketarchive",
+        # id сохраняется из ticket, поэтому без автоинкремента
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("queue_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", TICKET_STATUS, nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("called_at", sa.DateTime(), nullable=True),
+        sa.Column("confirmed_at", sa.DateTime(), nullable=True),
+        sa.Column("served_at", sa.DateTime(), nullable=True),
+        sa.Column("canceled_at", sa.DateTime(), nullable=True),
+        sa.Column("no_show_at", sa.DateTime(), nullable=True),
+        sa.Column("confirm_token", sa.String(), nullable=True),
+        sa.Column("confirm_token_expires_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_ticketarchive_user_id", "ticketarchive", ["user_id"])
+    op.create_index("ix_ticketarchive_created_at", "ticketarchive", ["created_at"])
+    op.create_index("ix_ticketarchive_queue_created", "ticketarchive", ["queue_id", "created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("ticketarchive")
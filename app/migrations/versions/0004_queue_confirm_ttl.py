@@ -0,0 +1,24 @@
+"""queue.confirm_ttl_min: срок QR вызванного для каждой трассы
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("queue", sa.Column("confirm_ttl_min", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("queue") as batch:
+        batch.drop_column("confirm_ttl_min")
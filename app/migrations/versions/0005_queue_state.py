@@ -0,0 +1,29 @@
+"""queue.state: трассы открываются/ставятся на паузу/закрываются операторами
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+QUEUE_STATE = sa.Enum("OPEN", "PAUSED", "CLOSED", name="queuestate")
+
+
+def upgrade() -> None:
+    # add_column не создаёт тип enum в Postgres сам (в SQLite это no-op)
+    QUEUE_STATE.create(op.get_bind(), checkfirst=False)
+    op.add_column("queue", sa.Column("state", QUEUE_STATE, nullable=False, server_default="OPEN"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("queue") as batch:
+        batch.drop_column("state")
+    QUEUE_STATE.drop(op.get_bind(), checkfirst=False)
@@ -0,0 +1,35 @@
+"""booking: локальная копия записей Rubitime
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "booking",
+        # id записи в Rubitime
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("queue_id", sa.Integer(), nullable=False),
+        sa.Column("starts_at", sa.DateTime(), nullable=False),
+        sa.Column("client_name", sa.String(), nullable=False),
+        sa.Column("phone", sa.String(), nullable=False),
+        sa.Column("canceled", sa.Boolean(), nullable=False),
+        sa.Column("remote_updated_at", sa.DateTime(), nullable=False),
+        sa.Column("ticket_id", sa.Integer(), nullable=True),
+    )
+    op.create_index("ix_booking_phone_starts", "booking", ["phone", "starts_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("booking")
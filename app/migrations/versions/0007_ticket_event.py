@@ -0,0 +1,42 @@
+"""ticketevent: журнал переходов тикетов
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+_STATUSES = ("WAITING", "CALLED", "CONFIRMED", "SERVED", "CANCELED", "NO_SHOW")
+# тип ticketstatus в Postgres уже создан в 0001
+TICKET_STATUS = sa.Enum(*_STATUSES, name="ticketstatus").with_variant(
+    postgresql.ENUM(*_STATUSES, name="ticketstatus", create_type=False), "postgresql"
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ticketevent",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("ticket_id", sa.Integer(), nullable=False),
+        sa.Column("queue_id", sa.Integer(), nullable=False),
+        sa.Column("from_status", TICKET_STATUS, nullable=True),
+        sa.Column("to_status", TICKET_STATUS, nullable=False),
+        sa.Column("operator_tg_id", sa.BigInteger(), nullable=True),
+        sa.Column("at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_ticketevent_ticket_id", "ticketevent", ["ticket_id"])
+    op.create_index("ix_ticketevent_at", "ticketevent", ["at"])
+    op.create_index("ix_ticketevent_queue_at", "ticketevent", ["queue_id", "at"])
+
+
+def downgrade() -> None:
+    op.drop_table("ticketevent")
@@ -0,0 +1,32 @@
+"""queue.id: сдвинуть последовательность за уже занятые id
+
+Старые версии бота вставляли трассы 1 и 2 с явным id, и последовательность queue_id_seq
+в Postgres осталась на 1: первый же create_queue падал на уникальности первичного ключа.
+В SQLite AUTOINCREMENT-а нет, новый id берётся как max(id) + 1 — там ничего делать не нужно.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # is_called=false: следующий nextval вернёт ровно max(id) + 1 (и 1 на пустой таблице)
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('queue', 'id'), COALESCE((SELECT max(id) FROM queue), 0) + 1, false)"
+    )
+
+
+def downgrade() -> None:
+    # сдвинутая последовательность совместима с любой схемой
+    pass
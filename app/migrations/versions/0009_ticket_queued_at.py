@@ -0,0 +1,50 @@
+"""ticket.queued_at: место в очереди отдельно от времени прихода
+
+Тикет по предварительной записи встаёт в очередь по времени записи, а created_at остаётся
+фактическим временем постановки (на нём считается ожидание в статистике).
+Для уже существующих тикетов место в очереди и было created_at.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+WAITING_WHERE = sa.text("status = 'WAITING'")
+
+
+def _waiting_index(column: str) -> None:
+    op.create_index(
+        "ix_ticket_waiting",
+        "ticket",
+        ["queue_id", column, "id"],
+        postgresql_where=WAITING_WHERE,
+        sqlite_where=WAITING_WHERE,
+    )
+
+
+def upgrade() -> None:
+    for table in ("ticket", "ticketarchive"):
+        op.add_column(table, sa.Column("queued_at", sa.DateTime(), nullable=True))
+        op.execute(f"UPDATE {table} SET queued_at = created_at")
+        with op.batch_alter_table(table) as batch:
+            batch.alter_column("queued_at", existing_type=sa.DateTime(), nullable=False)
+
+    op.drop_index("ix_ticket_waiting", table_name="ticket")
+    _waiting_index("queued_at")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ticket_waiting", table_name="ticket")
+    _waiting_index("created_at")
+    for table in ("ticketarchive", "ticket"):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("queued_at")
@@ -2,6 +2,7 @@ from __future__ import annotations
 from datetime import datetime
 from enum import Enum
 from typing import Optional
+from sqlalchemy import BigInteger, Index, text
 from sqlmodel import SQLModel, Field
 
 
@@ -14,9 +15,20 @@ class TicketStatus(str, Enum):
     NO_SHOW = "NO_SHOW"
 
 
+class QueueState(str, Enum):
+    OPEN = "OPEN"
+    # видна пользователям, но новых не принимает; операторы продолжают вызывать
+    PAUSED = "PAUSED"
+    # скрыта отовсюду
+    CLOSED = "CLOSED"
+
+
 class Queue(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
+    state: QueueState = Field(default=QueueState.OPEN, sa_column_kwargs={"server_default": QueueState.OPEN.value})
+    # сколько минут действует QR вызванного; None — settings.CONFIRM_TTL_MIN
+    confirm_ttl_min: Optional[int] = None
 
 
 class TgUser(SQLModel, table=True):
@@ -26,14 +38,24 @@ class TgUser(SQLModel, table=True):
     full_name: str = ""
 
 
-class Ticket(SQLModel, table=True):
+ACTIVE_WHERE = text("status IN ('WAITING', 'CALLED', 'CONFIRMED')")
+
+
+def _status_where(status: TicketStatus):
+    return text(f"status = '{status.value}'")
+
+
+class TicketFields(SQLModel):
     id: Optional[int] = Field(default=None, primary_key=True)
-    queue_id: int = Field(index=True)
+    # одиночные индексы queue_id/status перекрыты составными ниже
+    queue_id: int
     user_id: int = Field(index=True)
 
-    status: TicketStatus = Field(default=TicketStatus.WAITING, index=True)
+    status: TicketStatus = Field(default=TicketStatus.WAITING)
 
     created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    # место в очереди: обычно = created_at, у тикета по записи — время записи
+    queued_at: datetime = Field(default_factory=datetime.utcnow)
     called_at: Optional[datetime] = None
     confirmed_at: Optional[datetime] = None
     served_at: Optional[datetime] = None
@@ -42,3 +64,101 @@ class Ticket(SQLModel, table=True):
 
     confirm_token: Optional[str] = Field(default=None, index=True, unique=True)
     confirm_token_expires_at: Optional[datetime] = None
+
+
+class Ticket(TicketFields, table=True):
+    # схема меняется только миграциями (app/migrations); индексы здесь должны совпадать с ними
+    __table_args__ = (
+        Index("ix_ticket_queue_status_created", "queue_id", "status", "created_at"),
+        # не больше одного активного тикета на пользователя — гарантия на уровне БД
+        Index(
+            "ux_ticket_active_user",
+            "user_id",
+            unique=True,
+            postgresql_where=ACTIVE_WHERE,
+            sqlite_where=ACTIVE_WHERE,
+        ),
+        # голова очереди/позиция: WAITING по трассе в порядке места в очереди
+        Index(
+            "ix_ticket_waiting",
+            "queue_id",
+            "queued_at",
+            "id",
+            postgresql_where=_status_where(TicketStatus.WAITING),
+            sqlite_where=_status_where(TicketStatus.WAITING),
+        ),
+        # mark_no_show: самый давний CALLED
+        Index(
+            "ix_ticket_called",
+            "queue_id",
+            "called_at",
+            "id",
+            postgresql_where=_status_where(TicketStatus.CALLED),
+            sqlite_where=_status_where(TicketStatus.CALLED),
+        ),
+        # serve_confirmed: самый давний CONFIRMED
+        Index(
+            "ix_ticket_confirmed",
+            "queue_id",
+            "confirmed_at",
+            "id",
+            postgresql_where=_status_where(TicketStatus.CONFIRMED),
+            sqlite_where=_status_where(TicketStatus.CONFIRMED),
+        ),
+    )
+
+
+class TicketArchive(TicketFields, table=True):
+    """
+    Завершённые (SERVED/CANCELED/NO_SHOW) тикеты старше RETENTION_DAYS, перенесённые из ticket
+    (app.services.retention). id сохраняется исходный; горячие запросы сюда не ходят.
+    """
+
+    __table_args__ = (Index("ix_ticketarchive_queue_created", "queue_id", "created_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": False})
+    # по токену ищут только активные тикеты
+    confirm_token: Optional[str] = None
+
+
+class Booking(SQLModel, table=True):
+    """
+    Запись из Rubitime на сегодня (app.services.rubitime): локальная копия, которую фоном
+    обновляет лидер. Хендлеры читают только её, удалённый API — никогда.
+    """
+
+    __table_args__ = (Index("ix_booking_phone_starts", "phone", "starts_at"),)
+
+    # id записи в Rubitime
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": False})
+    queue_id: int
+    # время записи, naive UTC
+    starts_at: datetime
+    client_name: str = ""
+    # только цифры, с кодом страны (normalize_phone)
+    phone: str = ""
+    canceled: bool = False
+    # когда запись последний раз менялась в Rubitime (naive UTC): более старое изменение не применяем
+    remote_updated_at: datetime
+    # тикет, созданный при отметке прибытия; None — ещё не пришёл
+    ticket_id: Optional[int] = None
+
+
+class TicketEvent(SQLModel, table=True):
+    """
+    Журнал переходов тикетов, только добавление (app.services.event_log): кто и когда перевёл
+    тикет из какого статуса в какой. В отличие от *_at в ticket, повторные переходы не затираются.
+    """
+
+    __table_args__ = (Index("ix_ticketevent_queue_at", "queue_id", "at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ticket_id: int = Field(index=True)
+    queue_id: int
+    # None — тикет создан
+    from_status: Optional[TicketStatus] = None
+    to_status: TicketStatus
+    # оператор (tg id бывают больше 2^31); None — сам пользователь или фоновая задача
+    operator_tg_id: Optional[int] = Field(default=None, sa_type=BigInteger)
+    # когда переход закоммичен, naive UTC
+    at: datetime = Field(index=True)
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Callable, Optional, Sequence
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramConflictError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import Update
+
+from app.update_workers import UpdateWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class Poller:
+    """
+    Long polling getUpdates -> UpdateWorkerPool: апдейты разных чатов обрабатываются параллельно
+    (не больше числа воркеров), одного чата — по порядку. Пока пул занят, новые апдейты не запрашиваются.
+
+    Опрашивает только процесс-лидер (is_leader): второй getUpdates на тот же бот Telegram отклоняет.
+    Перед первым опросом и после каждого TelegramConflictError снимается webhook (getUpdates
+    не работает, пока он есть; его мог поставить и webhook-процесс уже после старта поллера).
+    После stop() уже полученные апдейты дообрабатываются пулом, а confirm() подтверждает
+    Telegram обработанные, чтобы после перезапуска они не пришли снова; не успевшие — придут.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        pool: UpdateWorkerPool,
+        allowed_updates: Sequence[str],
+        timeout: int = 25,
+        limit: int = 100,
+        is_leader: Callable[[], bool] = lambda: True,
+    ):
+        self.bot = bot
+        self.pool = pool
+        self.allowed_updates = list(allowed_updates)
+        self.timeout = timeout
+        self.limit = limit
+        self.is_leader = is_leader
+        self.offset: Optional[int] = None
+        self._stopping = asyncio.Event()
+        self._request: Optional[asyncio.Task] = None
+        self._webhook_dropped = False
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._request:
+            # незавершённый getUpdates ничего не подтвердил — его апдейты придут при следующем запуске
+            self._request.cancel()
+
+    async def run(self) -> None:
+        backoff = 0.0
+        while not self._stopping.is_set():
+            if not self.is_leader():
+                await self._sleep(1.0)
+                continue
+            if not self._webhook_dropped:
+                try:
+                    # накопленные апдейты сохраняем
+                    await self.bot.delete_webhook(drop_pending_updates=False)
+                    self._webhook_dropped = True
+                except Exception as e:
+                    backoff = min(5.0, backoff * 2 or 0.5)
+                    logger.warning("deleteWebhook failed (%s), retry in %.1fs", e, backoff)
+                    await self._sleep(backoff)
+                    continue
+            self._request = asyncio.create_task(
+                self.bot.get_updates(
+                    offset=self.offset,
+                    limit=self.limit,
+                    timeout=self.timeout,
+                    allowed_updates=self.allowed_updates,
+                    request_timeout=self.timeout + 10,
+                )
+            )
+            try:
+                updates = await self._request
+                backoff = 0.0
+            except asyncio.CancelledError:
+                if self._stopping.is_set():
+                    break
+                raise
+            except TelegramRetryAfter as e:
+                await self._sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError, TelegramConflictError) as e:
+                if isinstance(e, TelegramConflictError):
+                    self._webhook_dropped = False
+                backoff = min(5.0, backoff * 2 or 0.5)
+                logger.warning("getUpdates failed (%s), retry in %.1fs", e, backoff)
+                await self._sleep(backoff)
+                continue
+            finally:
+                self._request = None
+
+            for update in updates:
+                await self.pool.put(update)
+                self.offset = update.update_id + 1
+
+    async def confirm(self, unprocessed: Sequence[Update] = ()) -> None:
+        """
+        Подтвердить Telegram полученные апдейты — но не дальше первого необработанного:
+        он и всё после него придут снова (обработанные из них отсеет дедупликация пула).
+        """
+        if self.offset is None:
+            return
+        offset = min([self.offset, *(u.update_id for u in unprocessed)])
+        try:
+            await self.bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception:
+            logger.exception("failed to confirm processed updates")
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -1,6 +1,12 @@
 from __future__ import annotations
 
 from pathlib import Path
+from typing import Optional
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.config import settings
 
 TUNNEL_URL_FILE = Path("/run/tunnel/tunnel_url.txt")
 
@@ -13,3 +19,12 @@ def read_tunnel_base_url() -> str:
         return ""
     url = TUNNEL_URL_FILE.read_text(encoding="utf-8").strip()
     return url.rstrip("/")
+
+
+def bot_session() -> Optional[AiohttpSession]:
+    """
+    Сессия Bot API для TELEGRAM_API_URL; None — стандартная (api.telegram.org).
+    """
+    if not settings.TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL.rstrip("/")))
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from redis.asyncio import Redis
+from sqlmodel import select
+
+from app.db import get_session
+from app.models import QueueState, Ticket, TicketStatus
+from app.services.queue import ACTIVE_STATUSES, TicketChange, cached_queues, list_queues
+from app.services.wait_estimate import wait_estimator
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "rq:board"
+
+# переходы тикета монотонны: событие со статусом «раньше» уже известного — запоздавшее
+_RANK = {TicketStatus.WAITING: 0, TicketStatus.CALLED: 1, TicketStatus.CONFIRMED: 2}
+_DONE_RANK = 3
+# сколько последних завершённых тикетов помнить, чтобы запоздавшее событие их не воскресило
+DONE_MEMORY = 10_000
+
+
+def _ts(value: Optional[datetime]) -> float:
+    # даты хранятся как naive UTC
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else 0.0
+
+
+def _sort_key(ticket: Ticket) -> float:
+    if ticket.status == TicketStatus.CALLED:
+        return _ts(ticket.called_at)
+    if ticket.status == TicketStatus.CONFIRMED:
+        return _ts(ticket.confirmed_at)
+    return _ts(ticket.queued_at)
+
+
+class LiveBoard:
+    """
+    Публичное табло очереди (SSE в webhook_app) без запросов к БД на клиента.
+
+    Процесс, выполнивший переход тикета, публикует его один раз в Redis (publish_change —
+    слушатель app.services.queue). Каждый процесс с табло подписан на канал и ведёт в памяти
+    снимок активных тикетов; раз в interval секунд снимок рендерится в один JSON, который
+    получают все подключённые клиенты. Медленный клиент пропускает промежуточные версии.
+    Снимок целиком перечитывается из БД при старте, после переподписки и раз в resync_interval.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        interval: float = 0.5,
+        resync_interval: float = 60.0,
+        next_count: int = 5,
+        max_clients: int = 5000,
+        keepalive: float = 15.0,
+    ):
+        self.redis = redis
+        self.interval = interval
+        self.resync_interval = resync_interval
+        self.next_count = next_count
+        self.max_clients = max_clients
+        self.keepalive = keepalive
+        # ticket_id -> (queue_id, status, ключ сортировки)
+        self._tickets: dict[int, tuple[int, TicketStatus, float]] = {}
+        self._done: set[int] = set()
+        self._done_order: deque[int] = deque()
+        # id тикетов, пришедших событиями, пока идёт чтение снимка (по набору на каждый resync)
+        self._touched: list[set[int]] = []
+        self._dirty = asyncio.Event()
+        self._updated = asyncio.Event()
+        self._payload = b"{}"
+        self._version = 0
+        self._tasks: list[asyncio.Task] = []
+        self.clients = 0
+        self.events = 0
+        self.resyncs = 0
+
+    async def publish_change(self, change: TicketChange) -> None:
+        t = change.ticket
+        event = {"id": t.id, "q": t.queue_id, "s": t.status.value, "k": _sort_key(t)}
+        await self.redis.publish(CHANNEL, json.dumps(event))
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._listen(), name="board-listen"),
+            asyncio.create_task(self._render_loop(), name="board-render"),
+            asyncio.create_task(self._resync_loop(), name="board-resync"),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # разбудить открытые стримы, чтобы они завершились
+        self._updated.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def stats(self) -> dict:
+        return {"clients": self.clients, "events": self.events, "resyncs": self.resyncs, "version": self._version}
+
+    def snapshot(self) -> bytes:
+        return self._payload
+
+    def has_room(self) -> bool:
+        return self.clients < self.max_clients
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """
+        text/event-stream: текущий снимок сразу, дальше — каждая новая версия; комментарий-пинг
+        раз в keepalive, чтобы прокси не закрывали соединение.
+        """
+        self.clients += 1
+        try:
+            version = -1
+            while self.running:
+                if version != self._version:
+                    version = self._version
+                    yield b"data: " + self._payload + b"\n\n"
+                updated = self._updated
+                try:
+                    await asyncio.wait_for(updated.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+        finally:
+            self.clients -= 1
+
+    def _apply(self, ticket_id: int, queue_id: int, status: TicketStatus, key: float) -> None:
+        for touched in self._touched:
+            touched.add(ticket_id)
+        if ticket_id in self._done:
+            return
+        current = self._tickets.get(ticket_id)
+        rank = _RANK.get(status, _DONE_RANK)
+        if current is not None and _RANK[current[1]] > rank:
+            return
+        if status in ACTIVE_STATUSES:
+            self._tickets[ticket_id] = (queue_id, status, key)
+            return
+        self._tickets.pop(ticket_id, None)
+        self._done.add(ticket_id)
+        self._done_order.append(ticket_id)
+        if len(self._done_order) > DONE_MEMORY:
+            self._done.discard(self._done_order.popleft())
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                # подписка раньше снимка: события, пришедшие во время чтения, применятся поверх
+                await self.resync()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    event = json.loads(message["data"])
+                    self._apply(event["id"], event["q"], TicketStatus(event["s"]), event["k"])
+                    self.events += 1
+                    self._dirty.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("board subscription failed, resubscribing")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def _resync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                await self.resync()
+            except Exception:
+                logger.exception("board resync failed")
+
+    async def resync(self) -> None:
+        touched: set[int] = set()
+        self._touched.append(touched)
+        try:
+            async with get_session() as session:
+                await list_queues(session)
+                rows = (await session.exec(select(Ticket).where(Ticket.status.in_(ACTIVE_STATUSES)))).all()
+        finally:
+            self._touched.remove(touched)
+        tickets = {t.id: (t.queue_id, t.status, _sort_key(t)) for t in rows if t.id not in self._done}
+        # событие, пришедшее пока читали, могло уже продвинуть тикет дальше снимка
+        for ticket_id, entry in tickets.items():
+            current = self._tickets.get(ticket_id)
+            if current is not None and _RANK[current[1]] > _RANK[entry[1]]:
+                tickets[ticket_id] = current
+        # а тикет, созданный во время чтения, в снимок мог не попасть вовсе
+        for ticket_id in touched:
+            current = self._tickets.get(ticket_id)
+            if current is not None and ticket_id not in tickets and ticket_id not in self._done:
+                tickets[ticket_id] = current
+        self._tickets = tickets
+        self.resyncs += 1
+        self._dirty.set()
+
+    async def _render_loop(self) -> None:
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                self._payload = self._render()
+            except Exception:
+                logger.exception("board render failed")
+            else:
+                self._version += 1
+                updated, self._updated = self._updated, asyncio.Event()
+                updated.set()
+            # не чаще раза в interval: всплеск событий даёт одну версию
+            await asyncio.sleep(self.interval)
+
+    def _render(self) -> bytes:
+        by_queue: dict[int, dict[TicketStatus, list[tuple[float, int]]]] = {}
+        for ticket_id, (queue_id, status, key) in self._tickets.items():
+            by_queue.setdefault(queue_id, {}).setdefault(status, []).append((key, ticket_id))
+
+        queues = []
+        for q in cached_queues():
+            if q.state == QueueState.CLOSED:
+                continue
+            groups = by_queue.get(q.id, {})
+            waiting = groups.get(TicketStatus.WAITING, [])
+            queues.append(
+                {
+                    "id": q.id,
+                    "title": q.title,
+                    "state": q.state.value,
+                    "waiting": len(waiting),
+                    "next": [i for _, i in heapq.nsmallest(self.next_count, waiting)],
+                    "called": [i for _, i in sorted(groups.get(TicketStatus.CALLED, []))],
+                    "serving": [i for _, i in sorted(groups.get(TicketStatus.CONFIRMED, []))],
+                    # сколько ждать вставшему сейчас
+                    "eta_min": wait_estimator.estimate_minutes(q.id, len(waiting) + 1),
+                }
+            )
+        body = {"queues": queues, "ts": int(time.time())}
+        return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode()
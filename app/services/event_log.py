@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import logging
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import insert
+from sqlmodel import select
+
+from app.db import get_session
+from app.models import TicketEvent
+from app.services.queue import TicketChange
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ("id", "ticket_id", "queue_id", "from_status", "to_status", "operator_tg_id", "at")
+
+
+class EventLog:
+    """
+    Журнал переходов тикетов: слушатель app.services.queue только кладёт событие в буфер,
+    в БД события уходят пачками (один INSERT на пачку) из фоновой задачи — раз в interval
+    или как только набралось batch_size. Хендлер на запись журнала не ждёт.
+
+    Если БД недоступна, события копятся до max_pending; сверх — самые старые отбрасываются
+    (счётчик dropped). При stop оставшееся дописывается.
+    """
+
+    def __init__(self, interval: float = 1.0, batch_size: int = 500, max_pending: int = 100_000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: deque[dict] = deque()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+    async def on_ticket_change(self, change: TicketChange) -> None:
+        t = change.ticket
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append(
+            {
+                "ticket_id": t.id,
+                "queue_id": t.queue_id,
+                "from_status": change.prev_status,
+                "to_status": t.status,
+                "operator_tg_id": change.operator_tg_id,
+                "at": datetime.utcnow(),
+            }
+        )
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="event-log")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._pending:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("event log: %d events lost on shutdown", len(self._pending))
+                break
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "written": self.written, "dropped": self.dropped}
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                while self._pending:
+                    await self.flush()
+            except Exception:
+                logger.exception("event log flush failed")
+                await asyncio.sleep(self.interval)
+
+    async def flush(self) -> int:
+        """
+        Записать одну пачку. События убираются из буфера только после коммита.
+        """
+        batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+        if not batch:
+            return 0
+        async with get_session() as session:
+            await session.exec(insert(TicketEvent), params=batch)
+            await session.commit()
+        for _ in batch:
+            self._pending.popleft()
+        self.written += len(batch)
+        return len(batch)
+
+
+async def iter_events(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    queue_id: Optional[int] = None,
+    page_size: int = 1000,
+) -> AsyncIterator[TicketEvent]:
+    """
+    События журнала в порядке записи (по id), страницами по page_size: память постоянная
+    при любой длине журнала. Каждая страница — отдельная короткая сессия, соединение
+    не держится, пока потребитель обрабатывает события.
+    """
+    after_id = 0
+    while True:
+        stmt = select(TicketEvent).where(TicketEvent.id > after_id)
+        if since is not None:
+            stmt = stmt.where(TicketEvent.at >= since)
+        if until is not None:
+            stmt = stmt.where(TicketEvent.at < until)
+        if queue_id is not None:
+            stmt = stmt.where(TicketEvent.queue_id == queue_id)
+        async with get_session() as session:
+            page = (await session.exec(stmt.order_by(TicketEvent.id).limit(page_size))).all()
+        for event in page:
+            yield event
+        if len(page) < page_size:
+            return
+        after_id = page[-1].id
+
+
+async def export_csv(
+    since: Optional[datetime] = None, until: Optional[datetime] = None, queue_id: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    Журнал в CSV построчно (заголовок первой строкой) — для StreamingResponse.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def line(row) -> str:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        return buf.getvalue()
+
+    yield line(EXPORT_COLUMNS)
+    async for e in iter_events(since, until, queue_id):
+        yield line(
+            (
+                e.id,
+                e.ticket_id,
+                e.queue_id,
+                e.from_status.value if e.from_status else "",
+                e.to_status.value,
+                e.operator_tg_id or "",
+                e.at.isoformat(),
+            )
+        )
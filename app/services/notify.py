@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import BufferedInputFile
+
+from app.config import settings
+from app.db import get_session
+from app.models import Ticket
+from app.services.qr import make_qr_png, ticket_qr_payload
+from app.services.queue import queue_label, waiting_head_chats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Outgoing:
+    chat_id: int
+    text: str = ""
+    photo: Optional[bytes] = None
+    filename: str = "image.png"
+    # сообщения с одинаковым (chat_id, coalesce_key), ещё не отправленные, схлопываются в последнее
+    coalesce_key: Optional[str] = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Взять токен. 0 — взят; иначе сколько секунд подождать до следующего.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Notifier:
+    """
+    Исходящие сообщения Telegram через очередь с соблюдением лимитов Bot API:
+    глобальный token bucket (~30 msg/s) и не чаще одного сообщения в чат за NOTIFY_CHAT_INTERVAL.
+    Сообщения одного чата уходят по порядку, разные чаты — параллельно (до NOTIFY_CONCURRENCY).
+    429 (retry_after) приостанавливает всю отправку на указанное время и возвращает сообщение в очередь.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self._chats: OrderedDict[int, deque[Outgoing]] = OrderedDict()
+        self._chat_next_at: dict[int, float] = {}
+        self._in_flight: set[int] = set()
+        # лимит Bot API общий на бота — делим его между процессами
+        rate = settings.NOTIFY_GLOBAL_RATE / max(1, settings.APP_INSTANCES)
+        self._global = TokenBucket(rate, rate)
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sends: set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(settings.NOTIFY_CONCURRENCY)
+
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.retry_after_hits = 0
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self._task = asyncio.create_task(self._run(), name="notifier")
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while (self._chats or self._sends) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._chats.values())
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "retry_after": self.retry_after_hits,
+        }
+
+    def spawn(self, coro) -> None:
+        """
+        Фоновая задача (например, подготовка уведомлений), не задерживающая ответ хендлера.
+        """
+        task = asyncio.create_task(coro)
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    def send(self, msg: Outgoing) -> None:
+        """
+        Поставить сообщение в очередь; не ждёт отправки.
+        """
+        q = self._chats.get(msg.chat_id)
+        if q is None:
+            q = self._chats[msg.chat_id] = deque()
+        if msg.coalesce_key is not None:
+            for i, queued in enumerate(q):
+                if queued.coalesce_key == msg.coalesce_key:
+                    q[i] = msg
+                    self.coalesced += 1
+                    return
+        q.append(msg)
+        self._wakeup.set()
+
+    def send_text(self, chat_id: int, text: str, coalesce_key: Optional[str] = None) -> None:
+        self.send(Outgoing(chat_id=chat_id, text=text, coalesce_key=coalesce_key))
+
+    def send_photo(self, chat_id: int, photo: bytes, filename: str, caption: str = "") -> None:
+        self.send(Outgoing(chat_id=chat_id, text=caption, photo=photo, filename=filename))
+
+    def _next_ready_chat(self, now: float) -> tuple[Optional[int], float]:
+        """
+        Первый чат (в порядке поступления), которому уже можно писать, либо время ожидания до такого.
+        """
+        wait = None
+        for chat_id in self._chats:
+            if chat_id in self._in_flight:
+                continue
+            delay = self._chat_next_at.get(chat_id, 0.0) - now
+            if delay <= 0:
+                return chat_id, 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait if wait is not None else -1.0
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            chat_id, wait = self._next_ready_chat(now)
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    # wait < 0: ждать нечего, спим до нового сообщения/окончания отправки
+                    await asyncio.wait_for(self._wakeup.wait(), None if wait < 0 else wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.take()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            await self._slots.acquire()
+            msg = self._chats[chat_id].popleft()
+            if not self._chats[chat_id]:
+                del self._chats[chat_id]
+            self._in_flight.add(chat_id)
+            self._chat_next_at[chat_id] = time.monotonic() + settings.NOTIFY_CHAT_INTERVAL
+            task = asyncio.create_task(self._deliver(msg))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+            if len(self._chat_next_at) > 10_000:
+                self._chat_next_at = {c: t for c, t in self._chat_next_at.items() if t > now}
+
+    async def _deliver(self, msg: Outgoing) -> None:
+        try:
+            assert self.bot is not None
+            if msg.photo is not None:
+                await self.bot.send_photo(
+                    chat_id=msg.chat_id,
+                    photo=BufferedInputFile(msg.photo, filename=msg.filename),
+                    caption=msg.text or None,
+                )
+            else:
+                await self.bot.send_message(chat_id=msg.chat_id, text=msg.text)
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            self.retry_after_hits += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            # вернуть в начало очереди чата, чтобы не нарушить порядок
+            self._chats.setdefault(msg.chat_id, deque()).appendleft(msg)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бот заблокирован / чат недоступен — повторять бессмысленно
+            self.failed += 1
+            logger.info("notify chat %s dropped: %s", msg.chat_id, e)
+        except Exception:
+            self.failed += 1
+            logger.exception("notify chat %s failed", msg.chat_id)
+        finally:
+            self._in_flight.discard(msg.chat_id)
+            self._slots.release()
+            self._wakeup.set()
+
+
+notifier = Notifier()
+
+
+def position_text(queue_id: int, pos: int) -> str:
+    if pos == 1:
+        return f"{queue_label(queue_id)}: вы следующий! Будьте готовы."
+    return f"{queue_label(queue_id)}: вы {pos}-й в очереди."
+
+
+async def notify_positions(queue_id: int) -> None:
+    """
+    После вызова следующего — сообщить первым NOTIFY_AHEAD ожидающим их новую позицию.
+    Неотправленное прежнее сообщение о позиции в том же чате заменяется новым.
+    """
+    if settings.NOTIFY_AHEAD <= 0:
+        return
+    async with get_session() as session:
+        chats = await waiting_head_chats(session, queue_id=queue_id, limit=settings.NOTIFY_AHEAD)
+    for pos, chat_id in enumerate(chats, start=1):
+        notifier.send_text(chat_id, position_text(queue_id, pos), coalesce_key=f"pos:{queue_id}")
+
+
+async def notify_called(ticket: Ticket, chat_id: int) -> None:
+    """
+    Вызванному — QR для подтверждения у оператора.
+    """
+    if not ticket.confirm_token:
+        return
+    png = await make_qr_png(ticket_qr_payload(ticket))
+    notifier.send_photo(
+        chat_id,
+        png,
+        filename=f"ticket_{ticket.id}.png",
+        caption=f"Вас вызывают на {queue_label(ticket.queue_id)}! Покажите QR оператору для подтверждения.",
+    )
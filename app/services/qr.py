@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import struct
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import qrcode
+from qrcode.constants import ERROR_CORRECT_M
+
+from app.config import settings
+from app.metrics import QR_RENDER
+from app.models import Ticket
+
+# QR показывают с экрана телефона: крупный модуль не нужен, а узкой рамки сканеру хватает
+BOX_SIZE = 8
+BORDER = 2
+# подбор лучшей маски (8 полных прогонов со штрафами) — ~80% времени рендера;
+# любая маска валидна для сканера, а для QR на экране выигрыш от подбора не заметен
+MASK_PATTERN = 0
+
+CACHE_SIZE = 1024
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="qr")
+_cache: OrderedDict[str, bytes] = OrderedDict()
+
+
+def ticket_qr_payload(ticket: Ticket) -> str:
+    return f"q:{ticket.id}:{ticket.confirm_token}"
+
+
+def _make_qr(payload: str) -> qrcode.QRCode:
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECT_M, box_size=BOX_SIZE, border=BORDER, mask_pattern=MASK_PATTERN)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def qr_matrix(payload: str) -> list[list[bool]]:
+    return _make_qr(payload).get_matrix()
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def render_matrix_png(matrix: list[list[bool]], box_size: int = BOX_SIZE) -> bytes:
+    """
+    Матрица модулей -> 1-битный grayscale PNG напрямую через zlib, без PIL.
+    Каждая строка модулей кодируется один раз и повторяется box_size раз.
+    """
+    size = len(matrix) * box_size
+    row_bytes = (size + 7) // 8
+    raw = bytearray()
+    for row in matrix:
+        # 1 = белый, 0 = чёрный
+        bits = "".join(("0" if dark else "1") * box_size for dark in row)
+        bits += "1" * (row_bytes * 8 - size)
+        line = b"\x00" + int(bits, 2).to_bytes(row_bytes, "big")
+        raw += line * box_size
+
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def render_pil_png(payload: str) -> bytes:
+    bio = BytesIO()
+    _make_qr(payload).make_image().save(bio, format="PNG")
+    return bio.getvalue()
+
+
+def render_qr_png(payload: str) -> bytes:
+    with QR_RENDER.labels(settings.QR_RENDERER).time():
+        if settings.QR_RENDERER == "pil":
+            return render_pil_png(payload)
+        return render_matrix_png(qr_matrix(payload))
+
+
+async def make_qr_png(payload: str) -> bytes:
+    """
+    PNG c QR. Рендер — CPU-работа, поэтому уходит в пул потоков, а не блокирует event loop.
+    Повторная отправка того же payload отдаётся из LRU-кэша без похода в пул.
+    """
+    png = _cache.get(payload)
+    if png is not None:
+        _cache.move_to_end(payload)
+        return png
+
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(_executor, render_qr_png, payload)
+    _cache[payload] = png
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return png
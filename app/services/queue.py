@@ -1,184 +1,803 @@
 from __future__ import annotations
 
+import logging
+import time
 from datetime import datetime, timedelta, date
-from typing import Optional, Sequence
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, Sequence
 from uuid import uuid4
 
-from sqlmodel import Session, select
+from sqlalchemy import Update, and_, case, extract, func, or_, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import ScalarSelect
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.models import Queue, TgUser, Ticket, TicketStatus
+from app.config import settings
+from app.metrics import timed
+from app.models import Queue, QueueState, TgUser, Ticket, TicketArchive, TicketStatus
+from app.services.retention import archive_cutoff
+
+if TYPE_CHECKING:
+    from app.services.queue_mirror import QueueMirror
 
 ACTIVE_STATUSES = (TicketStatus.WAITING, TicketStatus.CALLED, TicketStatus.CONFIRMED)
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TicketChange:
+    ticket: Ticket
+    # None — тикет только что создан
+    prev_status: Optional[TicketStatus]
+    # известен при постановке в очередь
+    user: Optional[TgUser] = None
+    # tg id оператора, выполнившего переход; None — сам пользователь или фоновая задача
+    operator_tg_id: Optional[int] = None
+
+
+TicketListener = Callable[[TicketChange], Awaitable[None]]
+
+_listeners: list[TicketListener] = []
+_mirror: Optional["QueueMirror"] = None
+# оповестить другие процессы об изменении трасс (app.cache_bus); None — процесс один
+_queues_publisher: Optional[Callable[[], Awaitable[None]]] = None
+
+
+def add_ticket_listener(listener: TicketListener) -> None:
+    """
+    Подписка на каждый закоммиченный переход статуса тикета (зеркала, уведомления, аналитика).
+    """
+    _listeners.append(listener)
+
+
+def remove_ticket_listener(listener: TicketListener) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+async def _emit(change: TicketChange) -> None:
+    for listener in list(_listeners):
+        try:
+            await listener(change)
+        except Exception:
+            logger.exception("ticket listener %r failed", listener)
+
+
+def set_queue_mirror(mirror: Optional["QueueMirror"]) -> None:
+    """
+    Горячее состояние очереди (см. app.services.queue_mirror): чтения идут в него,
+    при любой ошибке/несоответствии — в SQL, а зеркало помечается на пересборку.
+    """
+    global _mirror
+    _mirror = mirror
+
+
+@timed("ensure_base_queues")
+async def ensure_base_queues(session: AsyncSession) -> None:
+    """
+    Пустая таблица queue заполняется трассами из DEFAULT_QUEUES; дальше трассы — данные (/queue).
+    """
+    if (await session.exec(select(Queue.id).limit(1))).first() is None:
+        for title in settings.default_queue_titles:
+            session.add(Queue(title=title))
+        await session.commit()
+    invalidate_queues()
+    await list_queues(session)
+
+
+# реестр трасс: читается на каждом показе клавиатуры/сообщении, меняется редко
+_queues: tuple[Queue, ...] = ()
+_queues_expires_at = 0.0
+
+
+def invalidate_queues() -> None:
+    global _queues_expires_at
+    _queues_expires_at = 0.0
 
-def ensure_base_queues(session: Session) -> None:
-    q1 = session.exec(select(Queue).where(Queue.id == 1)).first()
-    q2 = session.exec(select(Queue).where(Queue.id == 2)).first()
-    if not q1:
-        session.add(Queue(id=1, title="Трасса 1"))
-    if not q2:
-        session.add(Queue(id=2, title="Трасса 2"))
-    session.commit()
 
+def set_queues_publisher(publisher: Optional[Callable[[], Awaitable[None]]]) -> None:
+    global _queues_publisher
+    _queues_publisher = publisher
+
+
+async def _queues_changed() -> None:
+    invalidate_queues()
+    if _queues_publisher is not None:
+        try:
+            await _queues_publisher()
+        except Exception:
+            # остальные процессы перечитают реестр по QUEUE_REGISTRY_TTL
+            logger.exception("queue registry broadcast failed")
+
+
+async def list_queues(session: AsyncSession) -> tuple[Queue, ...]:
+    """
+    Все трассы (в т.ч. закрытые) по id. Из памяти; в БД — раз в QUEUE_REGISTRY_TTL
+    (изменения с других реплик) или сразу после изменения в этом процессе.
+    """
+    global _queues, _queues_expires_at
+    if _queues_expires_at > time.monotonic():
+        return _queues
+    rows = (await session.exec(select(Queue).order_by(Queue.id))).all()
+    # объекты живут в кэше дольше сессии — отвязываем их
+    for q in rows:
+        session.expunge(q)
+    _queues = tuple(rows)
+    _queues_expires_at = time.monotonic() + settings.QUEUE_REGISTRY_TTL
+    return _queues
+
+
+async def get_queue(session: AsyncSession, queue_id: int) -> Optional[Queue]:
+    for q in await list_queues(session):
+        if q.id == queue_id:
+            return q
+    return None
+
+
+def cached_queues() -> tuple[Queue, ...]:
+    """
+    Последний загруженный реестр трасс, без I/O.
+    """
+    return _queues
+
+
+def queue_label(queue_id: int) -> str:
+    """
+    Название трассы для сообщений, без I/O: по последнему загруженному реестру.
+    """
+    for q in _queues:
+        if q.id == queue_id:
+            return q.title
+    return f"Трасса {queue_id}"
+
+
+@timed("create_queue")
+async def create_queue(session: AsyncSession, title: str) -> Queue:
+    queue = Queue(title=title)
+    session.add(queue)
+    await session.commit()
+    await session.refresh(queue)
+    await _queues_changed()
+    return queue
+
+
+@timed("set_queue_state")
+async def set_queue_state(session: AsyncSession, queue_id: int, state: QueueState) -> Optional[Queue]:
+    queue = await session.get(Queue, queue_id)
+    if queue is None:
+        return None
+    queue.state = state
+    await session.commit()
+    await _queues_changed()
+    return queue
+
+
+# tg_user_id -> (expires_at, db id, tg_chat_id, full_name): нажатия кнопок не пишут в БД без изменений
+_user_cache: dict[int, tuple[float, int, int, str]] = {}
+USER_CACHE_MAX = 50_000
+
+
+def _cache_user(user: TgUser) -> TgUser:
+    if len(_user_cache) >= USER_CACHE_MAX:
+        now = time.monotonic()
+        for key in [k for k, v in _user_cache.items() if v[0] <= now]:
+            del _user_cache[key]
+        if len(_user_cache) >= USER_CACHE_MAX:
+            _user_cache.clear()
+    _user_cache[user.tg_user_id] = (
+        time.monotonic() + settings.USER_CACHE_TTL,
+        user.id,
+        user.tg_chat_id,
+        user.full_name,
+    )
+    return user
+
+
+def _cached_user(tg_user_id: int) -> Optional[TgUser]:
+    hit = _user_cache.get(tg_user_id)
+    if not hit:
+        return None
+    expires_at, db_id, tg_chat_id, full_name = hit
+    if expires_at <= time.monotonic():
+        del _user_cache[tg_user_id]
+        return None
+    return TgUser(id=db_id, tg_user_id=tg_user_id, tg_chat_id=tg_chat_id, full_name=full_name)
+
+
+@timed("lookup_user")
+async def lookup_user(session: AsyncSession, tg_user_id: int) -> Optional[TgUser]:
+    """
+    Только чтение: кэш, иначе один SELECT. Для проверок вроде «Моё место».
+    """
+    user = _cached_user(tg_user_id)
+    if user:
+        return user
+    user = (await session.exec(select(TgUser).where(TgUser.tg_user_id == tg_user_id))).first()
+    return _cache_user(user) if user else None
+
+
+@timed("upsert_user")
+async def upsert_user(session: AsyncSession, tg_user_id: int, tg_chat_id: int, full_name: str) -> TgUser:
+    """
+    Пишет в БД, только если пользователь новый или сменились чат/имя.
+    """
+    user = await lookup_user(session, tg_user_id)
+    if user and user.tg_chat_id == tg_chat_id and user.full_name == full_name:
+        return user
 
-def upsert_user(session: Session, tg_user_id: int, tg_chat_id: int, full_name: str) -> TgUser:
-    user = session.exec(select(TgUser).where(TgUser.tg_user_id == tg_user_id)).first()
     if user:
+        await session.exec(
+            update(TgUser).where(TgUser.id == user.id).values(tg_chat_id=tg_chat_id, full_name=full_name)
+        )
+        await session.commit()
         user.tg_chat_id = tg_chat_id
         user.full_name = full_name
-        session.add(user)
-        session.commit()
-        session.refresh(user)
-        return user
+        return _cache_user(user)
+
     user = TgUser(tg_user_id=tg_user_id, tg_chat_id=tg_chat_id, full_name=full_name)
     session.add(user)
-    session.commit()
-    session.refresh(user)
-    return user
+    try:
+        await session.commit()
+    except IntegrityError:
+        # параллельный первый апдейт того же пользователя успел вставить строку
+        await session.rollback()
+        _user_cache.pop(tg_user_id, None)
+        return await upsert_user(session, tg_user_id, tg_chat_id, full_name)
+    await session.refresh(user)
+    return _cache_user(user)
 
 
-def get_active_ticket(session: Session, user_db_id: int) -> Optional[Ticket]:
+@timed("get_active_ticket")
+async def get_active_ticket(session: AsyncSession, user_db_id: int) -> Optional[Ticket]:
     stmt = (
         select(Ticket)
         .where(Ticket.user_id == user_db_id)
         .where(Ticket.status.in_(ACTIVE_STATUSES))
         .order_by(Ticket.created_at.desc())
     )
-    return session.exec(stmt).first()
+    return (await session.exec(stmt)).first()
 
 
-def enqueue(session: Session, queue_id: int, user: TgUser) -> Ticket:
-    active = get_active_ticket(session, user.id)
-    if active:
-        return active
-    ticket = Ticket(queue_id=queue_id, user_id=user.id, status=TicketStatus.WAITING)
-    session.add(ticket)
-    session.commit()
-    session.refresh(ticket)
+@timed("peek_active_ticket")
+async def peek_active_ticket(session: AsyncSession, user_db_id: int) -> Optional[Ticket]:
+    """
+    get_active_ticket только для показа пользователю: из зеркала, если оно включено.
+    Пишущие пути (enqueue/leave) всегда идут в SQL.
+    """
+    if _mirror is not None:
+        try:
+            ticket = await _mirror.active_ticket(user_db_id)
+            if ticket is not None:
+                return ticket
+        except Exception:
+            _mirror.mark_dirty()
+    # «нет тикета» зеркалу на слово не верим: он мог появиться, пока зеркало пересобиралось
+    ticket = await get_active_ticket(session, user_db_id)
+    if ticket is not None and _mirror is not None:
+        _mirror.mark_dirty()
     return ticket
 
 
-def leave(session: Session, user: TgUser) -> bool:
-    active = get_active_ticket(session, user.id)
+# ux_ticket_active_user на гонке двух enqueue: со второй попытки тикет соседа уже виден
+ENQUEUE_ATTEMPTS = 3
+
+
+def _is_active_user_conflict(error: IntegrityError) -> bool:
+    # Postgres называет индекс, SQLite — только колонку
+    message = str(error.orig)
+    return "ux_ticket_active_user" in message or "ticket.user_id" in message
+
+
+async def enqueue(
+    session: AsyncSession, queue_id: int, user: TgUser, queued_at: Optional[datetime] = None
+) -> Optional[Ticket]:
+    """
+    Активный тикет пользователя (новый или уже существующий); None — трасса не принимает записи.
+    queued_at — место по предварительной записи: тикет встаёт в очередь так, будто пришёл
+    в это время (впереди всех, кто пришёл позже), и принимается также на паузе.
+    """
+    ticket, _ = await place_ticket(session, queue_id, user, queued_at)
+    return ticket
+
+
+@timed("enqueue")
+async def place_ticket(
+    session: AsyncSession, queue_id: int, user: TgUser, queued_at: Optional[datetime] = None
+) -> tuple[Optional[Ticket], bool]:
+    """
+    Как enqueue, плюс признак «тикет создан этим вызовом». False — вернулся уже существующий
+    активный тикет (в т.ч. созданный параллельным запросом): его место в очереди queued_at не задаёт.
+    """
+    accepting = (QueueState.OPEN, QueueState.PAUSED) if queued_at else (QueueState.OPEN,)
+    for attempt in range(ENQUEUE_ATTEMPTS):
+        active = await get_active_ticket(session, user.id)
+        if active:
+            return active, False
+        queue = await get_queue(session, queue_id)
+        if queue is None or queue.state not in accepting:
+            return None, False
+        now = datetime.utcnow()
+        # created_at — фактический приход (ожидание в статистике), queued_at — место в очереди
+        ticket = Ticket(
+            queue_id=queue_id, user_id=user.id, status=TicketStatus.WAITING, created_at=now, queued_at=queued_at or now
+        )
+        session.add(ticket)
+        try:
+            await session.commit()
+            break
+        except IntegrityError as e:
+            await session.rollback()
+            # ux_ticket_active_user: параллельный enqueue того же пользователя успел первым —
+            # следующая попытка вернёт его тикет; любое другое нарушение — ошибка
+            if not _is_active_user_conflict(e) or attempt == ENQUEUE_ATTEMPTS - 1:
+                raise
+            if user in session:
+                await session.refresh(user)
+    await session.refresh(ticket)
+    await _emit(TicketChange(ticket, None, user))
+    return ticket, True
+
+
+@timed("leave")
+async def leave(session: AsyncSession, user: TgUser) -> bool:
+    active = await get_active_ticket(session, user.id)
     if not active:
         return False
-    active.status = TicketStatus.CANCELED
-    active.canceled_at = datetime.utcnow()
-    session.add(active)
-    session.commit()
-    return True
+    # оператор мог успеть вызвать/завершить тикет между SELECT и UPDATE
+    stmt = (
+        update(Ticket)
+        .where(Ticket.id == active.id)
+        .where(Ticket.status.in_(ACTIVE_STATUSES))
+        .values(status=TicketStatus.CANCELED, canceled_at=datetime.utcnow())
+    )
+    return await _transition(session, stmt, active.status) is not None
 
 
-def position_in_queue(session: Session, ticket: Ticket) -> int:
+@timed("cancel_waiting")
+async def cancel_waiting(session: AsyncSession, ticket_id: int) -> Optional[Ticket]:
+    """
+    Снять тикет, пока его не вызвали (например, запись отменили во внешней системе).
+    """
     stmt = (
-        select(Ticket)
+        update(Ticket)
+        .where(Ticket.id == ticket_id)
+        .where(Ticket.status == TicketStatus.WAITING)
+        .values(status=TicketStatus.CANCELED, canceled_at=datetime.utcnow())
+    )
+    return await _transition(session, stmt, TicketStatus.WAITING)
+
+
+@timed("position_in_queue")
+async def position_in_queue(session: AsyncSession, ticket: Ticket) -> int:
+    """
+    Позиция = 1 + число WAITING-тикетов этой очереди с местом раньше (queued_at, id).
+    Один COUNT по частичному индексу ix_ticket_waiting, очередь целиком не грузим.
+    """
+    if ticket.status != TicketStatus.WAITING:
+        return 0
+    if _mirror is not None:
+        try:
+            pos = await _mirror.position(ticket)
+            if pos:
+                return pos
+        except Exception:
+            pass
+        # тикет WAITING, а в зеркале его нет — зеркало разошлось с БД
+        _mirror.mark_dirty()
+    stmt = (
+        select(func.count())
+        .select_from(Ticket)
         .where(Ticket.queue_id == ticket.queue_id)
         .where(Ticket.status == TicketStatus.WAITING)
-        .order_by(Ticket.created_at.asc())
+        .where(
+            or_(
+                Ticket.queued_at < ticket.queued_at,
+                and_(Ticket.queued_at == ticket.queued_at, Ticket.id < ticket.id),
+            )
+        )
     )
-    waiting = list(session.exec(stmt).all())
-    for idx, t in enumerate(waiting, start=1):
-        if t.id == ticket.id:
-            return idx
-    return 0
+    ahead = (await session.exec(stmt)).one()
+    return ahead + 1
 
 
-def list_waiting(session: Session, queue_id: int, limit: int = 30) -> Sequence[Ticket]:
+@timed("list_waiting")
+async def list_waiting(session: AsyncSession, queue_id: int, limit: int = 30) -> Sequence[Ticket]:
     stmt = (
         select(Ticket)
         .where(Ticket.queue_id == queue_id)
         .where(Ticket.status == TicketStatus.WAITING)
-        .order_by(Ticket.created_at.asc())
+        .order_by(Ticket.queued_at.asc(), Ticket.id.asc())
         .limit(limit)
     )
-    return session.exec(stmt).all()
+    return (await session.exec(stmt)).all()
 
 
-def call_next(session: Session, queue_id: int) -> Optional[Ticket]:
+@timed("list_waiting_with_names")
+async def list_waiting_with_names(
+    session: AsyncSession,
+    queue_id: int,
+    limit: int = 30,
+    after_ticket_id: Optional[int] = None,
+) -> list[tuple[Ticket, str]]:
+    """
+    Страница ожидающих вместе с именем пользователя — один запрос с JOIN на TgUser.
+    Пагинация keyset'ом по (queued_at, id): after_ticket_id — последний тикет предыдущей страницы.
+    """
+    if _mirror is not None:
+        try:
+            rows = await _mirror.list_waiting(queue_id, limit=limit, after_ticket_id=after_ticket_id)
+            if rows is not None:
+                return rows
+        except Exception:
+            _mirror.mark_dirty()
     stmt = (
-        select(Ticket)
+        select(Ticket, TgUser.full_name)
+        .join(TgUser, TgUser.id == Ticket.user_id, isouter=True)
+        .where(Ticket.queue_id == queue_id)
+        .where(Ticket.status == TicketStatus.WAITING)
+        .order_by(Ticket.queued_at.asc(), Ticket.id.asc())
+        .limit(limit)
+    )
+    if after_ticket_id is not None:
+        after_queued = select(Ticket.queued_at).where(Ticket.id == after_ticket_id).scalar_subquery()
+        stmt = stmt.where(
+            or_(
+                Ticket.queued_at > after_queued,
+                and_(Ticket.queued_at == after_queued, Ticket.id > after_ticket_id),
+            )
+        )
+    return [(t, name or "") for t, name in (await session.exec(stmt)).all()]
+
+
+@timed("waiting_head_chats")
+async def waiting_head_chats(session: AsyncSession, queue_id: int, limit: int) -> list[int]:
+    """
+    tg_chat_id первых limit ожидающих, по порядку очереди.
+    """
+    if _mirror is not None:
+        try:
+            return await _mirror.head_chats(queue_id, limit=limit)
+        except Exception:
+            _mirror.mark_dirty()
+    stmt = (
+        select(TgUser.tg_chat_id)
+        .join(Ticket, Ticket.user_id == TgUser.id)
         .where(Ticket.queue_id == queue_id)
         .where(Ticket.status == TicketStatus.WAITING)
-        .order_by(Ticket.created_at.asc())
+        .order_by(Ticket.queued_at.asc(), Ticket.id.asc())
+        .limit(limit)
+    )
+    return list((await session.exec(stmt)).all())
+
+
+@timed("queue_depths")
+async def queue_depths(session: AsyncSession) -> dict[tuple[int, str], int]:
+    """
+    Число активных тикетов по (трасса, статус) — для метрик.
+    """
+    stmt = (
+        select(Ticket.queue_id, Ticket.status, func.count())
+        .where(Ticket.status.in_(ACTIVE_STATUSES))
+        .group_by(Ticket.queue_id, Ticket.status)
     )
-    t = session.exec(stmt).first()
-    if not t:
+    return {(qid, status.value): count for qid, status, count in (await session.exec(stmt)).all()}
+
+
+def service_seconds(ticket: Ticket) -> Optional[float]:
+    """
+    Сколько трасса была занята тикетом: от вызова до SERVED/NO_SHOW. None — тикет не завершён.
+    """
+    done_at = ticket.served_at or ticket.no_show_at
+    if ticket.called_at is None or done_at is None:
         return None
-    t.status = TicketStatus.CALLED
-    t.called_at = datetime.utcnow()
-    t.confirm_token = uuid4().hex
-    t.confirm_token_expires_at = datetime.utcnow() + timedelta(minutes=15)
-    session.add(t)
-    session.commit()
-    session.refresh(t)
-    return t
+    return (done_at - ticket.called_at).total_seconds()
 
 
-def mark_no_show(session: Session, queue_id: int) -> Optional[Ticket]:
+@timed("recent_service_times")
+async def recent_service_times(session: AsyncSession, queue_id: int, limit: int) -> list[float]:
+    """
+    Время обслуживания последних limit завершённых тикетов трассы, от старых к новым.
+    Идёт по индексу (queue_id, status, created_at) — историю целиком не сканируем.
+    """
     stmt = (
-        select(Ticket)
+        select(Ticket.called_at, func.coalesce(Ticket.served_at, Ticket.no_show_at))
+        .where(Ticket.queue_id == queue_id)
+        .where(Ticket.status.in_((TicketStatus.SERVED, TicketStatus.NO_SHOW)))
+        .where(Ticket.called_at.is_not(None))
+        .order_by(Ticket.created_at.desc(), Ticket.id.desc())
+        .limit(limit)
+    )
+    rows = (await session.exec(stmt)).all()
+    return [(done_at - called_at).total_seconds() for called_at, done_at in reversed(rows) if done_at]
+
+
+def _head_of(queue_id: int, status: TicketStatus, order_by) -> ScalarSelect:
+    """
+    id первого тикета очереди в данном статусе. FOR UPDATE SKIP LOCKED (на Postgres):
+    параллельные операторы/воркеры берут разные строки, а не ждут друг друга.
+    На SQLite FOR UPDATE не рендерится — там запись и так сериализована.
+    """
+    return (
+        select(Ticket.id)
         .where(Ticket.queue_id == queue_id)
+        .where(Ticket.status == status)
+        .order_by(*order_by)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+
+
+async def _transition_all(
+    session: AsyncSession, stmt: Update, prev_status: TicketStatus, operator_tg_id: Optional[int] = None
+) -> list[Ticket]:
+    """
+    Атомарный переход статуса: один UPDATE ... WHERE <ожидаемый статус> RETURNING.
+    Строки, которые успел забрать кто-то другой, UPDATE не вернёт.
+    """
+    result = await session.exec(
+        stmt.returning(Ticket).execution_options(synchronize_session=False, populate_existing=True)
+    )
+    tickets = list(result.scalars().all())
+    await session.commit()
+    for t in tickets:
+        await _emit(TicketChange(t, prev_status, operator_tg_id=operator_tg_id))
+    return tickets
+
+
+async def _transition(
+    session: AsyncSession, stmt: Update, prev_status: TicketStatus, operator_tg_id: Optional[int] = None
+) -> Optional[Ticket]:
+    tickets = await _transition_all(session, stmt, prev_status, operator_tg_id)
+    return tickets[0] if tickets else None
+
+
+async def confirm_ttl(session: AsyncSession, queue_id: int) -> timedelta:
+    queue = await get_queue(session, queue_id)
+    minutes = queue.confirm_ttl_min if queue and queue.confirm_ttl_min else settings.CONFIRM_TTL_MIN
+    return timedelta(minutes=minutes)
+
+
+@timed("set_confirm_ttl")
+async def set_confirm_ttl(session: AsyncSession, queue_id: int, minutes: Optional[int]) -> bool:
+    """
+    Срок QR для трассы; None — вернуть общий CONFIRM_TTL_MIN. Действует на следующие вызовы.
+    """
+    queue = await session.get(Queue, queue_id)
+    if queue is None:
+        return False
+    queue.confirm_ttl_min = minutes
+    await session.commit()
+    await _queues_changed()
+    return True
+
+
+@timed("call_next")
+async def call_next(
+    session: AsyncSession, queue_id: int, operator_tg_id: Optional[int] = None
+) -> Optional[Ticket]:
+    now = datetime.utcnow()
+    ttl = await confirm_ttl(session, queue_id)
+    stmt = (
+        update(Ticket)
+        .where(Ticket.id == _head_of(queue_id, TicketStatus.WAITING, (Ticket.queued_at.asc(), Ticket.id.asc())))
+        .where(Ticket.status == TicketStatus.WAITING)
+        .values(
+            status=TicketStatus.CALLED,
+            called_at=now,
+            confirm_token=uuid4().hex,
+            confirm_token_expires_at=now + ttl,
+        )
+    )
+    return await _transition(session, stmt, TicketStatus.WAITING, operator_tg_id)
+
+
+@timed("mark_no_show")
+async def mark_no_show(
+    session: AsyncSession, queue_id: int, operator_tg_id: Optional[int] = None
+) -> Optional[Ticket]:
+    stmt = (
+        update(Ticket)
+        .where(Ticket.id == _head_of(queue_id, TicketStatus.CALLED, (Ticket.called_at.asc(), Ticket.id.asc())))
         .where(Ticket.status == TicketStatus.CALLED)
-        .order_by(Ticket.called_at.asc())
+        .values(status=TicketStatus.NO_SHOW, no_show_at=datetime.utcnow())
     )
-    t = session.exec(stmt).first()
-    if not t:
-        return None
-    t.status = TicketStatus.NO_SHOW
-    t.no_show_at = datetime.utcnow()
-    session.add(t)
-    session.commit()
-    session.refresh(t)
-    return t
+    return await _transition(session, stmt, TicketStatus.CALLED, operator_tg_id)
 
 
-def confirm_by_token(session: Session, token: str) -> Optional[Ticket]:
+@timed("expire_called")
+async def expire_called(session: AsyncSession, batch_size: int) -> list[Ticket]:
+    """
+    До batch_size CALLED с истёкшим QR -> NO_SHOW одним UPDATE; токены стираются.
+    """
     now = datetime.utcnow()
-    t = session.exec(select(Ticket).where(Ticket.confirm_token == token)).first()
-    if not t:
-        return None
-    if t.confirm_token_expires_at and t.confirm_token_expires_at < now:
-        return None
-    if t.status != TicketStatus.CALLED:
-        return None
-    t.status = TicketStatus.CONFIRMED
-    t.confirmed_at = now
-    session.add(t)
-    session.commit()
-    session.refresh(t)
-    return t
+    expired = (
+        select(Ticket.id)
+        .where(Ticket.status == TicketStatus.CALLED)
+        .where(Ticket.confirm_token_expires_at < now)
+        .order_by(Ticket.confirm_token_expires_at.asc())
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(Ticket)
+        .where(Ticket.id.in_(expired))
+        .where(Ticket.status == TicketStatus.CALLED)
+        .values(status=TicketStatus.NO_SHOW, no_show_at=now, confirm_token=None, confirm_token_expires_at=None)
+    )
+    return await _transition_all(session, stmt, TicketStatus.CALLED)
 
 
-def serve_confirmed(session: Session, queue_id: int) -> Optional[Ticket]:
+@timed("confirm_by_token")
+async def confirm_by_token(
+    session: AsyncSession, token: str, operator_tg_id: Optional[int] = None
+) -> Optional[Ticket]:
+    now = datetime.utcnow()
     stmt = (
-        select(Ticket)
-        .where(Ticket.queue_id == queue_id)
+        update(Ticket)
+        .where(Ticket.confirm_token == token)
+        .where(Ticket.status == TicketStatus.CALLED)
+        .where(or_(Ticket.confirm_token_expires_at.is_(None), Ticket.confirm_token_expires_at >= now))
+        .values(status=TicketStatus.CONFIRMED, confirmed_at=now)
+    )
+    return await _transition(session, stmt, TicketStatus.CALLED, operator_tg_id)
+
+
+# итог подтверждения одного токена в confirm_tokens
+CONFIRMED = "confirmed"
+ALREADY_CONFIRMED = "already_confirmed"
+EXPIRED = "expired"
+INVALID_STATE = "invalid_state"
+NOT_FOUND = "not_found"
+
+
+@timed("confirm_tokens")
+async def confirm_tokens(
+    session: AsyncSession, tokens: Sequence[str], operator_tg_id: Optional[int] = None
+) -> dict[str, tuple[str, Optional[Ticket]]]:
+    """
+    Пачка сканов (сканер копил их без сети): все подходящие CALLED -> CONFIRMED одним
+    UPDATE ... WHERE confirm_token IN (...). Повтор идемпотентен: уже подтверждённый
+    (или уже обслуженный) тикет даёт already_confirmed, а не ошибку.
+    Остальные токены разбираются одним SELECT. token -> (итог, тикет).
+    """
+    tokens = list(dict.fromkeys(tokens))
+    if not tokens:
+        return {}
+    now = datetime.utcnow()
+    stmt = (
+        update(Ticket)
+        .where(Ticket.confirm_token.in_(tokens))
+        .where(Ticket.status == TicketStatus.CALLED)
+        .where(or_(Ticket.confirm_token_expires_at.is_(None), Ticket.confirm_token_expires_at >= now))
+        .values(status=TicketStatus.CONFIRMED, confirmed_at=now)
+    )
+    confirmed = await _transition_all(session, stmt, TicketStatus.CALLED, operator_tg_id)
+    results: dict[str, tuple[str, Optional[Ticket]]] = {t.confirm_token: (CONFIRMED, t) for t in confirmed}
+
+    rest = [token for token in tokens if token not in results]
+    if rest:
+        for t in (await session.exec(select(Ticket).where(Ticket.confirm_token.in_(rest)))).all():
+            if t.status in (TicketStatus.CONFIRMED, TicketStatus.SERVED):
+                results[t.confirm_token] = (ALREADY_CONFIRMED, t)
+            elif t.status == TicketStatus.CALLED:
+                results[t.confirm_token] = (EXPIRED, t)
+            else:
+                results[t.confirm_token] = (INVALID_STATE, t)
+    return {token: results.get(token, (NOT_FOUND, None)) for token in tokens}
+
+
+@timed("serve_confirmed")
+async def serve_confirmed(
+    session: AsyncSession, queue_id: int, operator_tg_id: Optional[int] = None
+) -> Optional[Ticket]:
+    stmt = (
+        update(Ticket)
+        .where(Ticket.id == _head_of(queue_id, TicketStatus.CONFIRMED, (Ticket.confirmed_at.asc(), Ticket.id.asc())))
         .where(Ticket.status == TicketStatus.CONFIRMED)
-        .order_by(Ticket.confirmed_at.asc())
+        .values(status=TicketStatus.SERVED, served_at=datetime.utcnow())
     )
-    t = session.exec(stmt).first()
-    if not t:
-        return None
-    t.status = TicketStatus.SERVED
-    t.served_at = datetime.utcnow()
-    session.add(t)
-    session.commit()
-    session.refresh(t)
-    return t
+    return await _transition(session, stmt, TicketStatus.CONFIRMED, operator_tg_id)
+
+
+STAT_COUNTERS = ("created", "called", "confirmed", "served", "no_show", "canceled")
+
+
+def _seconds_between(session: AsyncSession, end, start):
+    if session.get_bind().dialect.name == "sqlite":
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    return extract("epoch", end - start)
+
 
+def _in_range(column, start: datetime, end: datetime):
+    return case((and_(column >= start, column < end), 1), else_=0)
 
-def day_stats(session: Session, day: date, queue_id: Optional[int] = None) -> dict:
+
+def _stats_source(start: datetime):
+    """
+    Таблица для статистики: только ticket, если период целиком новее границы архива,
+    иначе UNION ALL ticket и ticketarchive. У архивных тикетов все события раньше границы.
+    """
+    cutoff = archive_cutoff()
+    if cutoff is not None and start >= cutoff:
+        return Ticket.__table__
+    columns = [c.name for c in Ticket.__table__.columns]
+    return union_all(
+        select(*(Ticket.__table__.c[name] for name in columns)),
+        select(*(TicketArchive.__table__.c[name] for name in columns)),
+    ).subquery("ticket_all")
+
+
+@timed("day_stats")
+async def day_stats(
+    session: AsyncSession,
+    day: date,
+    day_to: Optional[date] = None,
+    queue_id: Optional[int] = None,
+) -> dict:
+    """
+    Статистика за [day, day_to] (включительно) одним агрегирующим запросом с GROUP BY queue_id.
+    Периоды старше RETENTION_DAYS считаются вместе с ticketarchive.
+
+    Возвращает {"queues": {queue_id: stats}, "total": stats}, где stats — счётчики
+    created/called/confirmed/served/no_show/canceled (по дате соответствующего события)
+    и средние avg_wait_sec (created_at -> called_at), avg_confirm_sec (called_at -> confirmed_at).
+    """
+    day_to = day_to or day
     start = datetime(day.year, day.month, day.day)
-    end = start + timedelta(days=1)
+    end = datetime(day_to.year, day_to.month, day_to.day) + timedelta(days=1)
+    t = _stats_source(start).c
 
-    created_stmt = select(Ticket).where(Ticket.created_at >= start).where(Ticket.created_at < end)
-    confirmed_stmt = select(Ticket).where(Ticket.confirmed_at >= start).where(Ticket.confirmed_at < end)
+    called_in_range = and_(t.called_at >= start, t.called_at < end)
+    confirmed_in_range = and_(t.confirmed_at >= start, t.confirmed_at < end)
 
+    stmt = (
+        select(
+            t.queue_id,
+            func.sum(_in_range(t.created_at, start, end)),
+            func.sum(_in_range(t.called_at, start, end)),
+            func.sum(_in_range(t.confirmed_at, start, end)),
+            func.sum(_in_range(t.served_at, start, end)),
+            func.sum(_in_range(t.no_show_at, start, end)),
+            func.sum(_in_range(t.canceled_at, start, end)),
+            func.avg(case((called_in_range, _seconds_between(session, t.called_at, t.created_at)))),
+            func.avg(case((confirmed_in_range, _seconds_between(session, t.confirmed_at, t.called_at)))),
+        )
+        .where(t.created_at < end)
+        .where(
+            or_(
+                t.created_at >= start,
+                t.called_at >= start,
+                t.confirmed_at >= start,
+                t.served_at >= start,
+                t.no_show_at >= start,
+                t.canceled_at >= start,
+            )
+        )
+        .group_by(t.queue_id)
+    )
     if queue_id is not None:
-        created_stmt = created_stmt.where(Ticket.queue_id == queue_id)
-        confirmed_stmt = confirmed_stmt.where(Ticket.queue_id == queue_id)
+        stmt = stmt.where(t.queue_id == queue_id)
+
+    queues: dict[int, dict] = {}
+    for row in (await session.exec(stmt)).all():
+        qid, *counts, avg_wait, avg_confirm = row
+        stats = {name: int(value or 0) for name, value in zip(STAT_COUNTERS, counts)}
+        stats["avg_wait_sec"] = float(avg_wait) if avg_wait is not None else None
+        stats["avg_confirm_sec"] = float(avg_confirm) if avg_confirm is not None else None
+        queues[qid] = stats
+
+    return {"queues": queues, "total": _total_stats(queues.values())}
+
 
-    return {
-        "created": len(session.exec(created_stmt).all()),
-        "confirmed": len(session.exec(confirmed_stmt).all()),
-    }
+def _total_stats(per_queue) -> dict:
+    per_queue = list(per_queue)
+    total = {name: sum(s[name] for s in per_queue) for name in STAT_COUNTERS}
+    # средние взвешиваем числом событий, по которым они считались
+    for key, weight in (("avg_wait_sec", "called"), ("avg_confirm_sec", "confirmed")):
+        weighted = [(s[key], s[weight]) for s in per_queue if s[key] is not None and s[weight]]
+        n = sum(w for _, w in weighted)
+        total[key] = sum(v * w for v, w in weighted) / n if n else None
+    return total
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from datetime import timezone
+from typing import Optional
+from uuid import uuid4
+
+from redis.asyncio import Redis
+from sqlmodel import select
+
+from app.db import get_session
+from app.models import Queue, TgUser, Ticket, TicketStatus
+from app.services.queue import (
+    ACTIVE_STATUSES,
+    TicketChange,
+    add_ticket_listener,
+    remove_ticket_listener,
+    set_queue_mirror,
+)
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "rq"
+
+
+def _waiting_key(queue_id: int) -> str:
+    return f"{PREFIX}:q:{queue_id}:waiting"
+
+
+TICKETS_KEY = f"{PREFIX}:tickets"  # ticket_id -> json активного тикета
+PEOPLE_KEY = f"{PREFIX}:people"  # ticket_id -> json {"name", "chat"}
+USERS_KEY = f"{PREFIX}:users"  # user_id -> ticket_id активного тикета
+RANKS_KEY = f"{PREFIX}:ranks"  # ticket_id -> ранг статуса активного тикета
+# пока идёт пересборка — флаг и id тикетов, изменённых за это время
+REBUILDING_KEY = f"{PREFIX}:mirror:rebuilding"
+TOUCHED_KEY = f"{PREFIX}:mirror:touched"
+REBUILD_LOCK = f"{PREFIX}:lock:mirror-rebuild"
+REBUILD_TIMEOUT = 120
+# плановую сверку за интервал делает один процесс
+RESYNC_KEY = f"{PREFIX}:mirror:resync"
+
+
+def _done_key(ticket_id: int) -> str:
+    return f"{PREFIX}:done:{ticket_id}"
+
+
+# переходы монотонны (WAITING -> CALLED -> CONFIRMED -> завершён): запоздавшее событие не откатывает тикет
+_RANK = {TicketStatus.WAITING: 0, TicketStatus.CALLED: 1, TicketStatus.CONFIRMED: 2}
+_DONE_RANK = 3
+# сколько помнить завершённый тикет, чтобы запоздавшее событие его не воскресило
+DONE_TTL = 3600
+
+# KEYS: waiting, tickets, people, users, ranks, done, rebuilding, touched
+# ARGV: ticket_id, member, score, rank, ticket json, user_id, people json ("" — не менять), done ttl
+_APPLY = """
+local rank = tonumber(ARGV[4])
+-- завершённый тикет только удаляется, что бы ни пришло
+if redis.call('exists', KEYS[6]) == 1 then rank = 3 end
+local current = tonumber(redis.call('hget', KEYS[5], ARGV[1]) or '-1')
+if current > rank then return 0 end
+if redis.call('exists', KEYS[7]) == 1 then redis.call('sadd', KEYS[8], ARGV[1]) end
+if rank == 0 then
+    redis.call('zadd', KEYS[1], ARGV[3], ARGV[2])
+else
+    redis.call('zrem', KEYS[1], ARGV[2])
+end
+if rank < 3 then
+    redis.call('hset', KEYS[2], ARGV[1], ARGV[5])
+    redis.call('hset', KEYS[4], ARGV[6], ARGV[1])
+    redis.call('hset', KEYS[5], ARGV[1], rank)
+    if ARGV[7] ~= '' then redis.call('hset', KEYS[3], ARGV[1], ARGV[7]) end
+else
+    redis.call('hdel', KEYS[2], ARGV[1])
+    redis.call('hdel', KEYS[3], ARGV[1])
+    redis.call('hdel', KEYS[5], ARGV[1])
+    if redis.call('hget', KEYS[4], ARGV[6]) == ARGV[1] then redis.call('hdel', KEYS[4], ARGV[6]) end
+    redis.call('set', KEYS[6], 1, 'EX', ARGV[8])
+end
+return 1
+"""
+
+
+def _score(ticket: Ticket) -> float:
+    # queued_at хранится как naive UTC
+    return ticket.queued_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _member(ticket_id: int) -> str:
+    # одинаковый score упорядочивается по member лексикографически — паддинг даёт порядок по id
+    return f"{ticket_id:012d}"
+
+
+def _dump(ticket: Ticket) -> str:
+    return ticket.model_dump_json()
+
+
+def _load(raw: bytes | str) -> Ticket:
+    return Ticket.model_validate(json.loads(raw))
+
+
+def _active_with_people():
+    return select(Ticket, TgUser.full_name, TgUser.tg_chat_id).join(TgUser, TgUser.id == Ticket.user_id, isouter=True)
+
+
+class QueueMirror:
+    """
+    WAITING-список каждой трассы в Redis (sorted set, score = queued_at), плюс активные тикеты
+    и имена/чаты их владельцев. Источник правды — таблица Ticket: зеркало обновляется слушателем
+    переходов из app.services.queue и целиком пересобирается из БД при старте, по таймеру
+    и после обнаруженного расхождения (mark_dirty).
+    """
+
+    def __init__(self, redis: Redis, resync_interval: float = 300.0):
+        self.redis = redis
+        self.resync_interval = resync_interval
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.rebuilds = 0
+        self._instance = uuid4().hex[:12]
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._resync_loop(), name="queue-mirror-resync")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def mark_dirty(self) -> None:
+        self._dirty.set()
+
+    async def _resync_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty.wait(), self.resync_interval)
+                dirty = True
+            except asyncio.TimeoutError:
+                dirty = False
+            self._dirty.clear()
+            try:
+                # плановая сверка — одна на интервал на все процессы; расхождение чиним сразу
+                if not dirty and not await self.redis.set(
+                    RESYNC_KEY, self._instance, nx=True, ex=max(1, int(self.resync_interval))
+                ):
+                    continue
+                if not await self.rebuild() and dirty:
+                    # пересобирает другой процесс; его снимок мог быть прочитан до расхождения
+                    await asyncio.sleep(1)
+                    self.mark_dirty()
+            except Exception:
+                logger.exception("queue mirror rebuild failed")
+                await asyncio.sleep(1)
+
+    async def rebuild(self) -> bool:
+        """
+        Снимок активных тикетов из БД -> временные ключи -> атомарный RENAME поверх рабочих.
+        Одновременно пересобирает один процесс (лок в Redis); False — лок занят другим.
+        Тикеты, изменённые кем угодно за время пересборки (TOUCHED_KEY), после подмены
+        перечитываются из БД и применяются с проверкой ранга — снимок их не откатывает.
+        """
+        lock = self.redis.lock(REBUILD_LOCK, timeout=REBUILD_TIMEOUT, blocking_timeout=0)
+        if not await lock.acquire():
+            return False
+        try:
+            await self._rebuild()
+            return True
+        finally:
+            try:
+                await lock.release()
+            except Exception:
+                logger.warning("queue mirror rebuild lock already expired")
+
+    async def _rebuild(self) -> None:
+        tx = self.redis.pipeline(transaction=True)
+        tx.set(REBUILDING_KEY, self._instance, ex=REBUILD_TIMEOUT)
+        tx.delete(TOUCHED_KEY)
+        await tx.execute()
+
+        async with get_session() as session:
+            queue_ids = list((await session.exec(select(Queue.id))).all())
+            rows = (await session.exec(_active_with_people().where(Ticket.status.in_(ACTIVE_STATUSES)))).all()
+
+        # временные ключи свои у каждого экземпляра: несколько процессов могут пересобирать одновременно
+        tmp = f"{PREFIX}:rebuild:{self._instance}"
+        live_keys = [_waiting_key(q) for q in queue_ids] + [TICKETS_KEY, PEOPLE_KEY, USERS_KEY, RANKS_KEY]
+        pipe = self.redis.pipeline(transaction=False)
+        for key in live_keys:
+            pipe.delete(f"{tmp}:{key}")
+        renames: set[str] = set()
+        for ticket, name, chat_id in rows:
+            if ticket.status == TicketStatus.WAITING:
+                key = _waiting_key(ticket.queue_id)
+                pipe.zadd(f"{tmp}:{key}", {_member(ticket.id): _score(ticket)})
+                renames.add(key)
+            pipe.hset(f"{tmp}:{TICKETS_KEY}", ticket.id, _dump(ticket))
+            pipe.hset(f"{tmp}:{PEOPLE_KEY}", ticket.id, json.dumps({"name": name or "", "chat": chat_id}))
+            pipe.hset(f"{tmp}:{USERS_KEY}", ticket.user_id, ticket.id)
+            pipe.hset(f"{tmp}:{RANKS_KEY}", ticket.id, _RANK[ticket.status])
+        await pipe.execute()
+
+        if rows:
+            renames |= {TICKETS_KEY, PEOPLE_KEY, USERS_KEY, RANKS_KEY}
+        tx = self.redis.pipeline(transaction=True)
+        tx.smembers(TOUCHED_KEY)
+        for key in set(live_keys) | renames:
+            if key in renames:
+                tx.rename(f"{tmp}:{key}", key)
+            else:
+                tx.delete(key)
+        tx.delete(TOUCHED_KEY, REBUILDING_KEY)
+        touched = [int(t) for t in (await tx.execute())[0]]
+
+        if touched:
+            async with get_session() as session:
+                fresh = (await session.exec(_active_with_people().where(Ticket.id.in_(touched)))).all()
+            for ticket, name, chat_id in fresh:
+                await self._apply(ticket, json.dumps({"name": name or "", "chat": chat_id}))
+        self.rebuilds += 1
+
+    async def on_change(self, change: TicketChange) -> None:
+        user = change.user
+        people = json.dumps({"name": user.full_name, "chat": user.tg_chat_id}) if user is not None else ""
+        try:
+            await self._apply(change.ticket, people)
+        except Exception:
+            self.mark_dirty()
+            raise
+
+    async def _apply(self, t: Ticket, people: str) -> None:
+        """
+        Записать состояние тикета, если оно не старее уже записанного (ранг статуса, метка завершения).
+        """
+        await self.redis.eval(
+            _APPLY,
+            8,
+            _waiting_key(t.queue_id),
+            TICKETS_KEY,
+            PEOPLE_KEY,
+            USERS_KEY,
+            RANKS_KEY,
+            _done_key(t.id),
+            REBUILDING_KEY,
+            TOUCHED_KEY,
+            t.id,
+            _member(t.id),
+            _score(t),
+            _RANK.get(t.status, _DONE_RANK),
+            _dump(t),
+            t.user_id,
+            people,
+            DONE_TTL,
+        )
+
+    async def position(self, ticket: Ticket) -> Optional[int]:
+        rank = await self.redis.zrank(_waiting_key(ticket.queue_id), _member(ticket.id))
+        return None if rank is None else rank + 1
+
+    async def _head(self, queue_id: int, limit: int, after_ticket_id: Optional[int]) -> Optional[list[int]]:
+        key = _waiting_key(queue_id)
+        start = 0
+        if after_ticket_id is not None:
+            rank = await self.redis.zrank(key, _member(after_ticket_id))
+            if rank is None:
+                # курсор уже вызван/вышел — позицию продолжения знает только SQL
+                return None
+            start = rank + 1
+        return [int(m) for m in await self.redis.zrange(key, start, start + limit - 1)]
+
+    async def list_waiting(
+        self, queue_id: int, limit: int, after_ticket_id: Optional[int] = None
+    ) -> Optional[list[tuple[Ticket, str]]]:
+        ids = await self._head(queue_id, limit, after_ticket_id)
+        if ids is None:
+            return None
+        if not ids:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(TICKETS_KEY, ids)
+        pipe.hmget(PEOPLE_KEY, ids)
+        raw_tickets, raw_people = await pipe.execute()
+        if any(r is None for r in raw_tickets):
+            raise LookupError("waiting ticket missing from mirror")
+        return [
+            (_load(raw), json.loads(person)["name"] if person else "")
+            for raw, person in zip(raw_tickets, raw_people)
+        ]
+
+    async def head_chats(self, queue_id: int, limit: int) -> list[int]:
+        ids = await self._head(queue_id, limit, None)
+        if not ids:
+            return []
+        people = await self.redis.hmget(PEOPLE_KEY, ids)
+        if any(p is None for p in people):
+            raise LookupError("waiting ticket owner missing from mirror")
+        return [json.loads(p)["chat"] for p in people]
+
+    async def active_ticket(self, user_db_id: int) -> Optional[Ticket]:
+        """
+        None — в зеркале тикета нет; это не значит, что его нет в БД (проверяет вызывающий).
+        """
+        ticket_id = await self.redis.hget(USERS_KEY, user_db_id)
+        if ticket_id is None:
+            return None
+        raw = await self.redis.hget(TICKETS_KEY, ticket_id)
+        if raw is None:
+            raise LookupError("active ticket missing from mirror")
+        return _load(raw)
+
+
+async def start_queue_mirror(redis: Redis, resync_interval: float) -> QueueMirror:
+    mirror = QueueMirror(redis, resync_interval=resync_interval)
+    await mirror.rebuild()
+    add_ticket_listener(mirror.on_change)
+    set_queue_mirror(mirror)
+    mirror.start()
+    return mirror
+
+
+async def stop_queue_mirror(mirror: QueueMirror) -> None:
+    set_queue_mirror(None)
+    remove_ticket_listener(mirror.on_change)
+    await mirror.stop()
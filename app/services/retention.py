@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.db import get_session
+from app.models import Ticket, TicketArchive, TicketStatus
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = (TicketStatus.SERVED, TicketStatus.CANCELED, TicketStatus.NO_SHOW)
+
+_COLUMNS = [c.name for c in Ticket.__table__.columns]
+
+
+def archive_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Граница архива: всё, что завершилось раньше неё, может лежать в ticketarchive. None — архив не ведётся.
+    """
+    if settings.RETENTION_DAYS <= 0:
+        return None
+    return (now or datetime.utcnow()) - timedelta(days=settings.RETENTION_DAYS)
+
+
+async def archive_batch(session: AsyncSession, cutoff: datetime, batch_size: int) -> int:
+    """
+    Перенести до batch_size завершённых тикетов, у которых и создание, и последнее событие
+    раньше cutoff, из ticket в ticketarchive одной транзакцией. Возвращает число перенесённых.
+    """
+    finished_at = func.coalesce(Ticket.served_at, Ticket.canceled_at, Ticket.no_show_at, Ticket.created_at)
+    ids = (
+        await session.exec(
+            select(Ticket.id)
+            .where(Ticket.created_at < cutoff)
+            .where(Ticket.status.in_(TERMINAL_STATUSES))
+            .where(finished_at < cutoff)
+            # SQLite без AUTOINCREMENT переиспользует id удалённой последней строки:
+            # самый новый тикет не трогаем, чтобы id в ticket и ticketarchive не пересеклись
+            .where(Ticket.id < select(func.max(Ticket.id)).scalar_subquery())
+            .order_by(Ticket.id)
+            .limit(batch_size)
+        )
+    ).all()
+    if not ids:
+        return 0
+
+    columns = [Ticket.__table__.c[name] for name in _COLUMNS]
+    await session.exec(
+        insert(TicketArchive).from_select(_COLUMNS, select(*columns).where(Ticket.id.in_(ids)))
+    )
+    # завершённый тикет больше не меняет статус, но условие повторяем на случай ручных правок
+    await session.exec(delete(Ticket).where(Ticket.id.in_(ids)).where(Ticket.status.in_(TERMINAL_STATUSES)))
+    await session.commit()
+    return len(ids)
+
+
+async def archive_tickets(cutoff: datetime, batch_size: int) -> int:
+    """
+    Перенос пачками, каждая в своей короткой транзакции, пока есть что переносить.
+    """
+    total = 0
+    while True:
+        async with get_session() as session:
+            try:
+                moved = await archive_batch(session, cutoff, batch_size)
+            except IntegrityError:
+                # ту же пачку параллельно перенёс другой процесс
+                await session.rollback()
+                logger.info("retention: batch already archived elsewhere")
+                moved = 0
+        total += moved
+        if moved < batch_size:
+            return total
+        await asyncio.sleep(0)
+
+
+class RetentionJob:
+    """
+    Периодический перенос завершённых тикетов в ticketarchive, чтобы горячая таблица ticket
+    содержала только активные и недавние тикеты.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+        self.last_run: Optional[datetime] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="ticket-retention")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> int:
+        cutoff = archive_cutoff()
+        if cutoff is None:
+            return 0
+        moved = await archive_tickets(cutoff, self.batch_size)
+        self.archived += moved
+        self.last_run = datetime.utcnow()
+        if moved:
+            logger.info("retention: archived %s tickets older than %s", moved, cutoff)
+        return moved
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("ticket retention failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"archived": self.archived, "last_run": self.last_run.isoformat() if self.last_run else None}
+
+
+def start_retention() -> Optional[RetentionJob]:
+    if settings.RETENTION_DAYS <= 0:
+        return None
+    job = RetentionJob(interval=settings.RETENTION_INTERVAL, batch_size=settings.RETENTION_BATCH)
+    job.start()
+    return job
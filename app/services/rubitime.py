@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import httpx
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.db import get_session
+from app.metrics import timed
+from app.models import Booking, TgUser, Ticket
+from app.services.notify import notifier
+from app.services.queue import cancel_waiting, place_ticket, queue_label
+
+logger = logging.getLogger(__name__)
+
+REMOTE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class RubitimeError(Exception):
+    pass
+
+
+def normalize_phone(raw: str) -> str:
+    """
+    Только цифры, российский номер — с 7 в начале: так сравниваются телефоны из Rubitime и из Telegram.
+    """
+    digits = re.sub(r"\D", "", raw or "")
+    if len(digits) == 11 and digits.startswith("8"):
+        return "7" + digits[1:]
+    if len(digits) == 10:
+        return "7" + digits
+    return digits
+
+
+@dataclass
+class RemoteRecord:
+    id: int
+    cooperator_id: int
+    # naive UTC
+    starts_at: datetime
+    client_name: str
+    phone: str
+    canceled: bool
+    updated_at: datetime
+
+
+class RubitimeClient:
+    """
+    API Rubitime через один httpx.AsyncClient: соединения держатся keep-alive и переиспользуются
+    между синхронизациями.
+
+    Ожидаемый контракт метода записей (POST JSON, локальная заглушка — bench/fake_rubitime.py):
+        {"rk": ключ, "date_from": ..., "date_to": ..., "updated_from": ..., "limit": N, "offset": M}
+        -> {"status": "ok", "data": [{"id", "record", "cooperator_id", "name", "phone", "status", "updated_at"}]}
+    Время — "YYYY-MM-DD HH:MM:SS" в часовом поясе tz; updated_from включительно; записи
+    отсортированы по (updated_at, id).
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        key: str,
+        method: str,
+        tz: ZoneInfo,
+        canceled_statuses: frozenset[str],
+        timeout: float = 10.0,
+        page_size: int = 500,
+    ):
+        self.key = key
+        self.method = method
+        self.tz = tz
+        self.canceled_statuses = canceled_statuses
+        self.page_size = page_size
+        self._http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/") + "/",
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=300),
+        )
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+    def to_remote(self, value: datetime) -> str:
+        return value.replace(tzinfo=timezone.utc).astimezone(self.tz).strftime(REMOTE_FORMAT)
+
+    def from_remote(self, value: str) -> datetime:
+        local = datetime.strptime(value, REMOTE_FORMAT).replace(tzinfo=self.tz)
+        return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+    async def records(
+        self, start: datetime, end: datetime, updated_from: Optional[datetime], offset: int = 0
+    ) -> list[RemoteRecord]:
+        payload: dict = {
+            "rk": self.key,
+            "date_from": self.to_remote(start),
+            "date_to": self.to_remote(end),
+            "limit": self.page_size,
+            "offset": offset,
+        }
+        if updated_from is not None:
+            payload["updated_from"] = self.to_remote(updated_from)
+        response = await self._http.post(self.method, json=payload)
+        response.raise_for_status()
+        body = response.json()
+        if body.get("status") != "ok":
+            raise RubitimeError(body.get("message") or f"rubitime {self.method}: {body.get('status')}")
+        return [self._parse(raw) for raw in body.get("data") or []]
+
+    async def changes(
+        self, start: datetime, end: datetime, since: Optional[datetime]
+    ) -> tuple[list[RemoteRecord], Optional[datetime]]:
+        """
+        Записи на [start, end), изменённые начиная с since (None — все), и курсор для следующего
+        вызова — максимальный updated_at. Листает по курсору; offset — только внутри группы записей
+        с одинаковым updated_at. Курсор включительный: запись на границе может прийти повторно,
+        apply_bookings её пропустит.
+        """
+        found: dict[int, RemoteRecord] = {}
+        cursor, offset = since, 0
+        while True:
+            page = await self.records(start, end, cursor, offset)
+            for record in page:
+                found[record.id] = record
+            if page:
+                last = page[-1].updated_at
+                if last == cursor:
+                    offset += len(page)
+                else:
+                    cursor, offset = last, sum(1 for r in page if r.updated_at == last)
+            if len(page) < self.page_size:
+                return list(found.values()), cursor
+
+    def _parse(self, raw: dict) -> RemoteRecord:
+        return RemoteRecord(
+            id=int(raw["id"]),
+            cooperator_id=int(raw.get("cooperator_id") or 0),
+            starts_at=self.from_remote(raw["record"]),
+            client_name=(raw.get("name") or "").strip(),
+            phone=normalize_phone(str(raw.get("phone") or "")),
+            canceled=str(raw.get("status")) in self.canceled_statuses,
+            updated_at=self.from_remote(raw.get("updated_at") or raw["record"]),
+        )
+
+
+@timed("apply_bookings")
+async def apply_bookings(session: AsyncSession, records: list[RemoteRecord], queue_map: dict[int, int]) -> int:
+    """
+    Записи из Rubitime -> таблица booking. Отмена записи снимает ещё не вызванный тикет
+    и сообщает об этом владельцу. Возвращает число применённых изменений.
+    """
+    records = [r for r in records if r.cooperator_id in queue_map]
+    if not records:
+        return 0
+    existing = {
+        b.id: b for b in (await session.exec(select(Booking).where(Booking.id.in_([r.id for r in records])))).all()
+    }
+    applied = 0
+    to_cancel: list[int] = []
+    for r in records:
+        booking = existing.get(r.id)
+        if booking is None:
+            booking = Booking(
+                id=r.id, queue_id=queue_map[r.cooperator_id], starts_at=r.starts_at, remote_updated_at=r.updated_at
+            )
+            session.add(booking)
+        elif booking.remote_updated_at >= r.updated_at:
+            # уже применено (повтор на границе курсора) или пришло устаревшее
+            continue
+        elif r.canceled and not booking.canceled and booking.ticket_id:
+            to_cancel.append(booking.ticket_id)
+        booking.queue_id = queue_map[r.cooperator_id]
+        booking.starts_at = r.starts_at
+        booking.client_name = r.client_name
+        booking.phone = r.phone
+        booking.canceled = r.canceled
+        booking.remote_updated_at = r.updated_at
+        applied += 1
+    await session.commit()
+
+    for ticket_id in to_cancel:
+        ticket = await cancel_waiting(session, ticket_id)
+        if ticket is None:
+            continue
+        user = await session.get(TgUser, ticket.user_id)
+        if user:
+            notifier.send_text(user.tg_chat_id, f"{queue_label(ticket.queue_id)}: запись отменена, вы сняты с очереди.")
+    return applied
+
+
+@timed("find_booking")
+async def find_booking(session: AsyncSession, phone: str, now: Optional[datetime] = None) -> Optional[Booking]:
+    """
+    Ближайшая неотменённая запись на этот телефон, по которой ещё не отмечались и время которой
+    в окне RUBITIME_CHECKIN_EARLY_MIN/LATE_MIN. Только локальная таблица, без запроса в Rubitime.
+    """
+    now = now or datetime.utcnow()
+    stmt = (
+        select(Booking)
+        .where(Booking.phone == phone)
+        .where(Booking.starts_at >= now - timedelta(minutes=settings.RUBITIME_CHECKIN_LATE_MIN))
+        .where(Booking.starts_at <= now + timedelta(minutes=settings.RUBITIME_CHECKIN_EARLY_MIN))
+        .where(Booking.canceled.is_(False))
+        .where(Booking.ticket_id.is_(None))
+        .order_by(Booking.starts_at)
+        .limit(1)
+    )
+    return (await session.exec(stmt)).first()
+
+
+@timed("check_in")
+async def check_in(session: AsyncSession, booking: Booking, user: TgUser) -> tuple[Optional[Ticket], bool]:
+    """
+    Отметка прибытия по записи: тикет на трассу записи с местом в очереди по времени записи
+    (впереди тех, кто пришёл без записи позже). Вызывать, когда активного тикета у пользователя нет.
+    (None, False) — трасса закрыта или по этой записи уже отметился кто-то другой;
+    (тикет, False) — активный тикет у пользователя успел появиться параллельно, запись не тронута.
+    """
+    ticket, created = await place_ticket(session, booking.queue_id, user, queued_at=booking.starts_at)
+    if ticket is None:
+        return None, False
+    if not created:
+        # чужой для этой отметки тикет: не привязываем к записи и тем более не снимаем
+        return ticket, False
+    claimed = await session.exec(
+        update(Booking).where(Booking.id == booking.id).where(Booking.ticket_id.is_(None)).values(ticket_id=ticket.id)
+    )
+    await session.commit()
+    if claimed.rowcount == 0:
+        # откатываем только тикет, созданный этим вызовом
+        await cancel_waiting(session, ticket.id)
+        return None, False
+    return ticket, True
+
+
+def local_time(value: datetime) -> str:
+    """
+    Время записи (naive UTC) так, как его видит клиент в Rubitime.
+    """
+    return value.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(settings.RUBITIME_TZ)).strftime("%H:%M")
+
+
+class RubitimeSync:
+    """
+    Фоновая синхронизация записей на сегодня (только в процессе-лидере). При старте и в начале
+    нового дня берутся все записи дня — их могли сделать задолго до сегодняшнего курсора; дальше
+    раз в interval только изменённые с максимального updated_at прошлой выборки.
+    Хендлеры с Rubitime не работают: они читают таблицу booking.
+    """
+
+    def __init__(self, client: RubitimeClient, interval: float, queue_map: dict[int, int]):
+        self.client = client
+        self.interval = interval
+        self.queue_map = queue_map
+        self._task: Optional[asyncio.Task] = None
+        self._day: Optional[date] = None
+        self._cursor: Optional[datetime] = None
+        self.applied = 0
+        self.errors = 0
+        self.last_sync: Optional[datetime] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="rubitime-sync")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.client.close()
+
+    def stats(self) -> dict:
+        return {
+            "applied": self.applied,
+            "errors": self.errors,
+            "last_sync": self.last_sync.isoformat() if self.last_sync else None,
+        }
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("rubitime sync failed")
+            await asyncio.sleep(self.interval)
+
+    def _today(self) -> tuple[date, datetime, datetime]:
+        tz = self.client.tz
+        day = datetime.now(tz).date()
+        start = datetime.combine(day, time.min, tzinfo=tz)
+        end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+        return day, start.astimezone(timezone.utc).replace(tzinfo=None), end.astimezone(timezone.utc).replace(tzinfo=None)
+
+    async def run_once(self) -> int:
+        day, start, end = self._today()
+        since = self._cursor if day == self._day else None
+        records, cursor = await self.client.changes(start, end, since)
+        async with get_session() as session:
+            applied = await apply_bookings(session, records, self.queue_map)
+        # курсор сдвигается только после того, как изменения записаны
+        self._day, self._cursor = day, cursor
+        self.applied += applied
+        self.last_sync = datetime.utcnow()
+        return applied
+
+
+def start_rubitime_sync() -> Optional[RubitimeSync]:
+    if not settings.rubitime_enabled:
+        return None
+    client = RubitimeClient(
+        settings.RUBITIME_URL,
+        settings.RUBITIME_KEY,
+        settings.RUBITIME_RECORDS_METHOD,
+        tz=ZoneInfo(settings.RUBITIME_TZ),
+        canceled_statuses=settings.rubitime_canceled_statuses,
+        timeout=settings.RUBITIME_TIMEOUT,
+        page_size=settings.RUBITIME_PAGE_SIZE,
+    )
+    sync = RubitimeSync(client, interval=settings.RUBITIME_SYNC_INTERVAL, queue_map=settings.rubitime_queue_map)
+    sync.start()
+    return sync
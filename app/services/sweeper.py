@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.db import get_session
+from app.models import TgUser
+from app.services.notify import notifier, notify_called, notify_positions
+from app.services.queue import call_next, expire_called, queue_label
+
+logger = logging.getLogger(__name__)
+
+
+async def _chats(session: AsyncSession, user_ids: list[int]) -> dict[int, int]:
+    """
+    user_id -> tg_chat_id для всей пачки одним запросом.
+    """
+    if not user_ids:
+        return {}
+    rows = await session.exec(select(TgUser.id, TgUser.tg_chat_id).where(TgUser.id.in_(set(user_ids))))
+    return dict(rows.all())
+
+
+class CalledSweeper:
+    """
+    Периодически переводит CALLED с истёкшим QR в NO_SHOW (пачками, одним UPDATE на пачку),
+    сообщает об этом владельцу и при auto_call вызывает на освободившееся место следующего.
+    """
+
+    def __init__(self, interval: float, batch_size: int, auto_call: bool = False):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.auto_call = auto_call
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+        self.auto_called = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="called-sweeper")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"expired": self.expired, "auto_called": self.auto_called}
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("called sweeper failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        handled = 0
+        while True:
+            async with get_session() as session:
+                expired = await expire_called(session, self.batch_size)
+                chats = await _chats(session, [t.user_id for t in expired])
+            for t in expired:
+                chat_id = chats.get(t.user_id)
+                if chat_id:
+                    notifier.send_text(
+                        chat_id, f"{queue_label(t.queue_id)}: время подтверждения истекло, вызов отменён."
+                    )
+            handled += len(expired)
+            self.expired += len(expired)
+            if self.auto_call and expired:
+                await self._call_next([t.queue_id for t in expired])
+            if len(expired) < self.batch_size:
+                return handled
+
+    async def _call_next(self, queue_ids: list[int]) -> None:
+        """
+        По одному вызову на каждый истёкший тикет; владельцы вызванных — одним запросом.
+        """
+        called = []
+        async with get_session() as session:
+            for queue_id in queue_ids:
+                t = await call_next(session, queue_id=queue_id)
+                if t:
+                    called.append(t)
+            chats = await _chats(session, [t.user_id for t in called])
+        self.auto_called += len(called)
+        for t in called:
+            chat_id = chats.get(t.user_id)
+            if chat_id:
+                await notify_called(t, chat_id)
+        for queue_id in {t.queue_id for t in called}:
+            notifier.spawn(notify_positions(queue_id))
+
+
+def start_sweeper() -> Optional[CalledSweeper]:
+    if settings.SWEEP_INTERVAL <= 0:
+        return None
+    sweeper = CalledSweeper(
+        interval=settings.SWEEP_INTERVAL, batch_size=settings.SWEEP_BATCH, auto_call=settings.SWEEP_AUTO_CALL
+    )
+    sweeper.start()
+    return sweeper
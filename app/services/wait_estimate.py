@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import math
+from typing import Optional
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.models import TicketStatus
+from app.services.queue import TicketChange, list_queues, recent_service_times, service_seconds
+
+# выбросы (трассу вызвали и забыли на ночь) в модель не берём
+MAX_SAMPLE_SECONDS = 2 * 3600
+
+
+class WaitEstimator:
+    """
+    Прогноз ожидания: по каждой трассе в памяти — экспоненциально сглаженное (EWMA) время,
+    на которое трасса занята одним тикетом (вызов -> SERVED/NO_SHOW). Обновляется слушателем
+    переходов по одному завершённому тикету, историю не пересчитывает; при старте модель
+    собирается по последним WAIT_HISTORY тикетам каждой трассы.
+
+    Образец — длительность конкретного тикета, а не интервал между завершениями: процесс
+    видит только свои переходы, и при нескольких workers интервалы были бы завышены.
+    """
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        # queue_id -> (сглаженное время обслуживания, секунды; число образцов)
+        self._model: dict[int, tuple[float, int]] = {}
+
+    def observe(self, queue_id: int, seconds: float) -> None:
+        if seconds < 0 or seconds > MAX_SAMPLE_SECONDS:
+            return
+        prev = self._model.get(queue_id)
+        if prev is None:
+            self._model[queue_id] = (seconds, 1)
+        else:
+            mean, samples = prev
+            self._model[queue_id] = (mean + self.alpha * (seconds - mean), samples + 1)
+
+    async def on_ticket_change(self, change: TicketChange) -> None:
+        """
+        Слушатель app.services.queue: serve_confirmed, mark_no_show и истечение QR (sweeper).
+        """
+        t = change.ticket
+        if t.status not in (TicketStatus.SERVED, TicketStatus.NO_SHOW):
+            return
+        seconds = service_seconds(t)
+        if seconds is not None:
+            self.observe(t.queue_id, seconds)
+
+    async def rebuild(self, session: AsyncSession, history: int) -> None:
+        model: dict[int, tuple[float, int]] = {}
+        self._model, previous = model, self._model
+        try:
+            for queue in await list_queues(session):
+                for seconds in await recent_service_times(session, queue.id, history):
+                    self.observe(queue.id, seconds)
+        except Exception:
+            self._model = previous
+            raise
+
+    def service_time(self, queue_id: int) -> Optional[float]:
+        entry = self._model.get(queue_id)
+        return entry[0] if entry else None
+
+    def estimate_minutes(self, queue_id: int, position: int) -> Optional[int]:
+        """
+        Ожидание для позиции position (1 — следующий), целые минуты; None — по трассе ещё нет истории.
+        """
+        mean = self.service_time(queue_id)
+        if mean is None or position <= 0:
+            return None
+        return max(1, math.ceil(position * mean / 60))
+
+    def stats(self) -> dict:
+        return {str(qid): {"service_s": round(mean, 1), "samples": n} for qid, (mean, n) in self._model.items()}
+
+
+wait_estimator = WaitEstimator(alpha=settings.WAIT_EWMA_ALPHA)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаём gzip
+    brotli = None
+
+
+class StaticAsset:
+    """
+    Файл, загруженный в память один раз, с заранее сжатыми вариантами (br/gzip) и strong ETag.
+    При reload=True перечитывается, если изменился mtime (для разработки).
+    """
+
+    def __init__(self, path: Path, media_type: str, max_age: int = 300, reload: bool = False):
+        self.path = path
+        self.media_type = media_type
+        self.max_age = max_age
+        self.reload = reload
+        self._mtime: Optional[float] = None
+        # encoding ("" — без сжатия) -> (body, etag)
+        self._variants: dict[str, tuple[bytes, str]] = {}
+        self.load()
+
+    def load(self) -> None:
+        raw = self.path.read_bytes()
+        self._mtime = self.path.stat().st_mtime
+        digest = hashlib.sha256(raw).hexdigest()[:32]
+        # ETag strong, поэтому у каждого представления свой
+        variants = {"": (raw, f'"{digest}"'), "gzip": (gzip.compress(raw, 9, mtime=0), f'"{digest}-gz"')}
+        if brotli is not None:
+            variants["br"] = (brotli.compress(raw, quality=11), f'"{digest}-br"')
+        self._variants = variants
+
+    def _maybe_reload(self) -> None:
+        if self.reload and self.path.stat().st_mtime != self._mtime:
+            self.load()
+
+    def _pick_encoding(self, accept_encoding: str) -> str:
+        # coding -> q-value (RFC 9110, 12.5.3); q=0 — явный отказ от кодировки
+        weights: dict[str, float] = {}
+        for part in accept_encoding.split(","):
+            coding, *params = (p.strip() for p in part.split(";"))
+            if not coding:
+                continue
+            q = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            weights[coding.lower()] = q
+        # "*" распространяется на кодировки, не названные явно
+        wildcard = weights.get("*", 0.0)
+        best, best_q = "", 0.0
+        for enc in ("br", "gzip"):
+            q = weights.get(enc, wildcard)
+            if q > best_q and enc in self._variants:
+                best, best_q = enc, q
+        return best
+
+    def response(self, request: Request) -> Response:
+        self._maybe_reload()
+        encoding = self._pick_encoding(request.headers.get("accept-encoding", ""))
+        body, etag = self._variants[encoding]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={self.max_age}, must-revalidate",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        # 304 только если у клиента то же представление, что отдали бы сейчас; If-None-Match
+        # сравнивается слабо (RFC 9110), W/ от прокси не мешает
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        if if_none_match.strip() == "*" or etag in tags:
+            return Response(status_code=304, headers=headers)
+
+        return Response(content=body, media_type=self.media_type, headers=headers)
+
+
+def load_asset(path: Path, media_type: str, max_age: int = 300, reload: bool = False) -> Optional[StaticAsset]:
+    if not path.exists():
+        return None
+    return StaticAsset(path, media_type, max_age=max_age, reload=reload)
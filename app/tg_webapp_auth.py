@@ -1,10 +1,16 @@
 from __future__ import annotations
 import hashlib
 import hmac
+import time
+from collections import OrderedDict
 from urllib.parse import parse_qsl
 
 
-def validate_init_data(init_data: str, bot_token: str) -> dict:
+def webapp_secret_key(bot_token: str) -> bytes:
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+def _check_hash(init_data: str, secret_key: bytes) -> dict:
     data = dict(parse_qsl(init_data, keep_blank_values=True))
     received_hash = data.pop("hash", None)
     if not received_hash:
@@ -13,10 +19,52 @@ def validate_init_data(init_data: str, bot_token: str) -> dict:
     pairs = [f"{k}={v}" for k, v in sorted(data.items())]
     data_check_string = "\n".join(pairs)
 
-    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
     calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
 
     if not hmac.compare_digest(calculated_hash, received_hash):
         raise ValueError("Bad initData hash")
 
     return data
+
+
+def validate_init_data(init_data: str, bot_token: str) -> dict:
+    return _check_hash(init_data, webapp_secret_key(bot_token))
+
+
+class InitDataValidator:
+    """
+    Проверка initData Telegram WebApp с ключом, вычисленным один раз из токена бота.
+
+    Сканер шлёт одну и ту же initData на каждый скан всей сессии WebApp, поэтому
+    недавно проверенные строки запоминаются (небольшой LRU) и повторно HMAC не считаются.
+    auth_date проверяется на свежесть при каждом обращении, в том числе из кэша.
+    """
+
+    def __init__(self, bot_token: str, max_age: int = 86400, cache_size: int = 256):
+        self._secret_key = webapp_secret_key(bot_token)
+        self.max_age = max_age
+        self._cache_size = cache_size
+        self._verified: OrderedDict[str, dict] = OrderedDict()
+
+    def validate(self, init_data: str) -> dict:
+        data = self._verified.get(init_data)
+        if data is None:
+            data = _check_hash(init_data, self._secret_key)
+            self._verified[init_data] = data
+            if len(self._verified) > self._cache_size:
+                self._verified.popitem(last=False)
+        else:
+            self._verified.move_to_end(init_data)
+
+        self._check_fresh(data)
+        return dict(data)
+
+    def _check_fresh(self, data: dict) -> None:
+        if self.max_age <= 0:
+            return
+        try:
+            auth_date = int(data.get("auth_date", ""))
+        except ValueError:
+            raise ValueError("No auth_date in initData")
+        if time.time() - auth_date > self.max_age:
+            raise ValueError("initData expired")
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from redis.asyncio import Redis
+
+from app.metrics import UPDATE_LAG
+
+logger = logging.getLogger(__name__)
+
+
+def order_key(update: Update) -> int:
+    """
+    Ключ упорядочивания: апдейты одного чата (или пользователя) обрабатываются строго по очереди.
+    """
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+
+def _seen_key(update_id: int) -> str:
+    return f"rq:update:{update_id}"
+
+
+class UpdateWorkerPool:
+    """
+    Фоновая обработка апдейтов: webhook-endpoint кладёт апдейт в очередь и сразу отвечает 200,
+    polling (app.polling) — ждёт места в очереди.
+
+    Очередь шардирована по order_key: у каждого воркера своя asyncio.Queue,
+    поэтому апдейты одного чата не обгоняют друг друга, а разные чаты идут параллельно.
+    Повторы Telegram (тот же update_id) отбрасываются общей для всех процессов отметкой в Redis
+    (SET NX EX на dedup_ttl): повтор может прийти в другой воркер uvicorn или реплику.
+    Если Redis недоступен, апдейт принимается без проверки — лучше обработать дважды, чем потерять.
+    """
+
+    def __init__(
+        self, dp: Dispatcher, bot: Bot, redis: Redis, workers: int, queue_size: int, dedup_ttl: int = 3600
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.redis = redis
+        self.dedup_ttl = dedup_ttl
+        per_shard = max(1, queue_size // workers)
+        self._queues: list[asyncio.Queue[tuple[Update, float]]] = [asyncio.Queue(maxsize=per_shard) for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
+        # апдейт, который воркер шарда обрабатывает прямо сейчас
+        self._inflight: list[Update | None] = [None] * workers
+
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker(i, q), name=f"update-worker-{i}") for i, q in enumerate(self._queues)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> list[Update]:
+        """
+        Дожидаемся обработки уже принятых апдейтов (не дольше timeout), затем гасим воркеров.
+        Возвращает апдейты, которые так и не обработали (из очередей и прерванные на середине);
+        их отметки дедупликации сняты, чтобы повторную доставку приняли.
+        """
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("update workers: %s updates left unprocessed on shutdown", self.depth)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        left = [u for u in self._inflight if u is not None]
+        self._inflight = [None] * len(self._queues)
+        for q in self._queues:
+            while not q.empty():
+                left.append(q.get_nowait()[0])
+                q.task_done()
+        for update in left:
+            await self._release(update.update_id)
+        return sorted(left, key=lambda u: u.update_id)
+
+    async def _claim(self, update_id: int) -> bool:
+        """
+        False — этот update_id уже принят (здесь или в другом процессе).
+        """
+        try:
+            return bool(await self.redis.set(_seen_key(update_id), 1, nx=True, ex=self.dedup_ttl))
+        except Exception:
+            logger.warning("update dedup unavailable, accepting %s unchecked", update_id, exc_info=True)
+            return True
+
+    async def _release(self, update_id: int) -> None:
+        try:
+            await self.redis.delete(_seen_key(update_id))
+        except Exception:
+            logger.warning("update dedup: failed to release %s", update_id, exc_info=True)
+
+    async def submit(self, update: Update) -> bool:
+        """
+        Постановка без ожидания места. False — очередь шарда переполнена (backpressure):
+        вызывающий отвечает Telegram ошибкой, и тот повторит доставку позже.
+        """
+        q = self._queues[order_key(update) % len(self._queues)]
+        if q.full():
+            self.rejected += 1
+            return False
+        if not await self._claim(update.update_id):
+            self.duplicates += 1
+            return True
+        try:
+            q.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            # место заняли, пока ходили в Redis: отметку снимаем, чтобы повтор Telegram приняли
+            await self._release(update.update_id)
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    async def put(self, update: Update) -> None:
+        """
+        Постановка с ожиданием места в шарде — для polling, где апдейт некуда вернуть.
+        """
+        if not await self._claim(update.update_id):
+            self.duplicates += 1
+            return
+        await self._queues[order_key(update) % len(self._queues)].put((update, time.perf_counter()))
+        self.accepted += 1
+
+    @property
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._queues),
+            "depth": self.depth,
+            "max_shard_depth": max(q.qsize() for q in self._queues),
+            "capacity": sum(q.maxsize for q in self._queues),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def _worker(self, shard: int, q: asyncio.Queue[tuple[Update, float]]) -> None:
+        while True:
+            update, accepted_at = await q.get()
+            self._inflight[shard] = update
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("update %s failed", update.update_id)
+            finally:
+                UPDATE_LAG.observe(time.perf_counter() - accepted_at)
+                q.task_done()
+            # сюда не доходим, только если воркер отменили посреди обработки
+            self._inflight[shard] = None
@@ -1,53 +1,92 @@
 from __future__ import annotations
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from datetime import datetime
 from pathlib import Path
+import hmac
+import json
+import logging
+import time
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.redis import RedisStorage
-from redis.asyncio import Redis
 from aiogram.types import Update
 
+from app.bootstrap import Runtime
 from app.config import settings
-from app.db import init_db, get_session
-from app.services.queue import ensure_base_queues, confirm_by_token
-from app.bot.handlers_user import user_router
-from app.bot.handlers_operator import operator_router, is_operator
-from app.tg_webapp_auth import validate_init_data
+from app.db import get_session
+from app.metrics import WEBHOOK_ACK, render_latest, set_queue_depths
+from app.services.event_log import export_csv
+from app.services.queue import confirm_by_token, confirm_tokens, queue_depths
+from app.bot.handlers_operator import is_operator
+from app.static_assets import StaticAsset, load_asset
+from app.tg_webapp_auth import InitDataValidator
+from app.update_workers import UpdateWorkerPool
 
+logger = logging.getLogger(__name__)
+
+runtime: Runtime | None = None
 bot: Bot | None = None
 dp: Dispatcher | None = None
+workers: UpdateWorkerPool | None = None
+scanner_asset: StaticAsset | None = None
 
 SCANNER_HTML_PATH = Path("webapp/scanner.html")
 
+init_data_validator = InitDataValidator(settings.BOT_TOKEN, max_age=settings.WEBAPP_AUTH_MAX_AGE)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global bot, dp
-
-    init_db()
-    with get_session() as session:
-        ensure_base_queues(session)
-
-    bot = Bot(token=settings.BOT_TOKEN)
-
-    redis = Redis.from_url(settings.REDIS_URL)
-    dp = Dispatcher(storage=RedisStorage(redis=redis))  # RedisStorage поддерживается aiogram [web:206]
-    dp.include_router(user_router)
-    dp.include_router(operator_router)
 
+async def _register_webhook() -> None:
+    """
+    Webhook регистрирует только лидер. Без drop_pending_updates: при перезапуске/смене лидера
+    апдейты, накопленные Telegram, не теряются.
+    """
+    assert bot is not None
     await bot.set_webhook(
         url=settings.webhook_url,
         secret_token=settings.WEBHOOK_SECRET or None,
-        drop_pending_updates=True,
+        drop_pending_updates=False,
     )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global runtime, bot, dp, workers, scanner_asset
+
+    scanner_asset = load_asset(
+        SCANNER_HTML_PATH,
+        "text/html; charset=utf-8",
+        max_age=settings.WEBAPP_CACHE_MAX_AGE,
+        reload=settings.WEBAPP_DEV_RELOAD,
+    )
+
+    runtime = Runtime()
+    bot, dp = runtime.bot, runtime.dp
+    runtime.on_elected(_register_webhook)
+    await runtime.start()
+    await runtime.board.start()
+
+    if settings.UPDATE_WORKERS > 0:
+        workers = UpdateWorkerPool(
+            dp,
+            bot,
+            runtime.redis,
+            workers=settings.UPDATE_WORKERS,
+            queue_size=settings.UPDATE_QUEUE_SIZE,
+            dedup_ttl=settings.UPDATE_DEDUP_TTL,
+        )
+        workers.start()
     yield
 
-    if bot:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await bot.session.close()
+    # webhook не удаляем: при rolling restart его обслуживают остальные процессы,
+    # а пока не поднялся никто, Telegram копит апдейты у себя
+    if workers:
+        # Telegram на них уже получил 200 и повторять не будет
+        unprocessed = await workers.stop()
+        if unprocessed:
+            logger.error("update workers: dropped updates %s", [u.update_id for u in unprocessed])
+    await runtime.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -55,11 +94,79 @@ app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 async def health():
-    return {"ok": True}
+    body = {"ok": True, **(runtime.stats() if runtime else {})}
+    if workers:
+        body["updates"] = workers.stats()
+    return body
+
+
+@app.get("/metrics")
+async def metrics():
+    async with get_session() as session:
+        set_queue_depths(await queue_depths(session))
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/board")
+async def board():
+    """
+    Табло одним JSON — для тех, кому не нужен стрим. Из памяти, без БД.
+    """
+    assert runtime is not None
+    return Response(content=runtime.board.snapshot(), media_type="application/json", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/board/stream")
+async def board_stream():
+    """
+    Живое табло (Server-Sent Events) для экрана на площадке и WebApp: только чтение, без авторизации.
+    """
+    assert runtime is not None
+    if not runtime.board.has_room():
+        raise HTTPException(status_code=503, detail="too many board clients")
+    return StreamingResponse(
+        runtime.board.stream(),
+        media_type="text/event-stream",
+        # nginx и подобные не должны буферизовать стрим
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/events.csv")
+async def events_csv(
+    request: Request, since: datetime | None = None, until: datetime | None = None, queue_id: int | None = None
+):
+    """
+    Выгрузка журнала переходов тикетов потоком CSV (память не зависит от объёма). since/until — naive UTC.
+    """
+    if not settings.EXPORT_TOKEN:
+        raise HTTPException(status_code=404, detail="export disabled")
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {settings.EXPORT_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="bad export token")
+    return StreamingResponse(
+        export_csv(since, until, queue_id),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="ticket_events.csv"'},
+    )
 
 
 @app.post("/tg/webhook")
 async def tg_webhook(request: Request):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        outcome = await _handle_webhook(request)
+        return {"ok": True}
+    except HTTPException as e:
+        outcome = str(e.status_code)
+        raise
+    finally:
+        WEBHOOK_ACK.labels(outcome).observe(time.perf_counter() - started)
+
+
+async def _handle_webhook(request: Request) -> str:
     if settings.WEBHOOK_SECRET:
         secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
         if secret != settings.WEBHOOK_SECRET:
@@ -68,44 +175,85 @@ async def tg_webhook(request: Request):
     data = await request.json()
     update = Update.model_validate(data)
     assert dp is not None and bot is not None
+    if workers:
+        # сразу 200, обработка в фоне; при переполнении — 503, Telegram повторит позже
+        if not await workers.submit(update):
+            raise HTTPException(status_code=503, detail="update queue is full")
+        return "queued"
     await dp.feed_update(bot, update)
-    return {"ok": True}
+    return "processed"
 
 
-@app.get("/webapp/scanner", response_class=HTMLResponse)
-async def webapp_scanner():
-    if not SCANNER_HTML_PATH.exists():
+@app.get("/webapp/scanner")
+async def webapp_scanner(request: Request):
+    if scanner_asset is None:
         raise HTTPException(status_code=500, detail="scanner.html not found")
-    return SCANNER_HTML_PATH.read_text(encoding="utf-8")
+    return scanner_asset.response(request)
 
 
-@app.post("/api/confirm")
-async def api_confirm(payload: dict):
-    token = (payload.get("token") or "").strip()
-    init_data = (payload.get("init_data") or "").strip()
-
-    if not token:
-        raise HTTPException(status_code=400, detail="token required")
+def _operator_id(init_data: str) -> int:
+    """
+    tg id оператора из initData сканера; 400/401/403 — если initData нет, она не подписана или это не оператор.
+    """
     if not init_data:
         raise HTTPException(status_code=400, detail="init_data required")
-
     try:
-        data = validate_init_data(init_data, settings.BOT_TOKEN)
+        data = init_data_validator.validate(init_data)
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
 
     # user в initData приходит как JSON-строка
-    # для простоты вытащим tg user id через примитивный парсинг (лучше: json.loads)
-    import json
     user = json.loads(data.get("user", "{}"))
     tg_user_id = int(user.get("id", 0))
     if not tg_user_id or not is_operator(tg_user_id):
         raise HTTPException(status_code=403, detail="Not an operator")
+    return tg_user_id
 
-    with get_session() as session:
-        t = confirm_by_token(session, token=token)
+
+@app.post("/api/confirm")
+async def api_confirm(payload: dict):
+    token = (payload.get("token") or "").strip()
+    init_data = (payload.get("init_data") or "").strip()
+
+    if not token:
+        raise HTTPException(status_code=400, detail="token required")
+    operator_tg_id = _operator_id(init_data)
+
+    async with get_session() as session:
+        t = await confirm_by_token(session, token=token, operator_tg_id=operator_tg_id)
 
     if not t:
         raise HTTPException(status_code=404, detail="ticket not found / expired / invalid state")
 
     return {"ok": True, "ticket_id": t.id, "queue_id": t.queue_id, "status": t.status}
+
+
+@app.post("/api/confirm/batch")
+async def api_confirm_batch(payload: dict):
+    """
+    Сканы, накопленные сканером (в т.ч. без сети), одним запросом: initData проверяется один раз,
+    токены подтверждаются одним UPDATE. Повтор той же пачки безопасен — итог по каждому токену.
+    """
+    raw_tokens = payload.get("tokens")
+    # строку иначе разобрали бы посимвольно, словарь — по ключам
+    if not isinstance(raw_tokens, list) or not all(isinstance(t, str) for t in raw_tokens):
+        raise HTTPException(status_code=400, detail="tokens must be a list of strings")
+    tokens = [t.strip() for t in raw_tokens if t.strip()]
+    init_data = (payload.get("init_data") or "").strip()
+
+    if not tokens:
+        raise HTTPException(status_code=400, detail="tokens required")
+    if len(tokens) > settings.CONFIRM_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"at most {settings.CONFIRM_BATCH_MAX} tokens per batch")
+    operator_tg_id = _operator_id(init_data)
+
+    async with get_session() as session:
+        outcomes = await confirm_tokens(session, tokens, operator_tg_id=operator_tg_id)
+
+    results = []
+    for token, (result, t) in outcomes.items():
+        item = {"token": token, "result": result}
+        if t is not None:
+            item.update(ticket_id=t.id, queue_id=t.queue_id, status=t.status)
+        results.append(item)
+    return {"ok": True, "results": results}
@@ -0,0 +1,130 @@
+"""
+Локальная заглушка Rubitime для app.services.rubitime: записи на сегодня по нескольким сотрудникам
+(cooperator_id), метод записей с фильтрами date_from/date_to/updated_from и страницами limit/offset.
+С --churn часть записей периодически отменяется или переносится — так видна дельта-синхронизация.
+
+    uv run python -m bench.fake_rubitime [--port 8091] [--bookings 60] [--cooperators 101,102] [--churn 0.05]
+
+Приложение: RUBITIME_URL=http://127.0.0.1:8091/api2 RUBITIME_KEY=fake RUBITIME_QUEUE_MAP=101:1,102:2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+FORMAT = "%Y-%m-%d %H:%M:%S"
+KEY = "fake"
+CANCELED = 4
+
+
+class FakeRubitime:
+    """
+    Записи хранятся в памяти; время — строки в часовом поясе tz, как в Rubitime.
+    """
+
+    def __init__(self, bookings: int, cooperators: list[int], tz: ZoneInfo, phone_base: int = 79_000_000_000):
+        self.tz = tz
+        self.records: dict[int, dict] = {}
+        self.requests = 0
+        now = datetime.now(tz)
+        first = now.replace(hour=9, minute=0, second=0, microsecond=0)
+        created = (now - timedelta(days=3)).strftime(FORMAT)
+        for i in range(bookings):
+            slot = first + timedelta(minutes=10 * (i // len(cooperators)))
+            self.records[i + 1] = {
+                "id": i + 1,
+                "record": slot.strftime(FORMAT),
+                "cooperator_id": cooperators[i % len(cooperators)],
+                "name": f"Клиент {i + 1}",
+                "phone": f"+{phone_base + i + 1}",
+                "status": 0,
+                "updated_at": created,
+            }
+
+    def _touch(self, record: dict) -> None:
+        record["updated_at"] = datetime.now(self.tz).strftime(FORMAT)
+
+    def cancel(self, record_id: int) -> None:
+        record = self.records[record_id]
+        record["status"] = CANCELED
+        self._touch(record)
+
+    def move(self, record_id: int, minutes: int) -> None:
+        record = self.records[record_id]
+        slot = datetime.strptime(record["record"], FORMAT) + timedelta(minutes=minutes)
+        record["record"] = slot.strftime(FORMAT)
+        self._touch(record)
+
+    async def churn(self, rate: float, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for record_id in list(self.records):
+                if random.random() < rate:
+                    if random.random() < 0.5:
+                        self.cancel(record_id)
+                    else:
+                        self.move(record_id, random.choice((-10, 10, 20)))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api2/{method}", self._handle)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        if body.get("rk") != KEY:
+            return web.json_response({"status": "error", "message": "bad key"})
+        if request.match_info["method"] != "get-records":
+            return web.json_response({"status": "error", "message": "unknown method"})
+
+        # строки одного формата сравниваются как время
+        records = [
+            r
+            for r in self.records.values()
+            if body["date_from"] <= r["record"] < body["date_to"]
+            and ("updated_from" not in body or r["updated_at"] >= body["updated_from"])
+        ]
+        records.sort(key=lambda r: (r["updated_at"], r["id"]))
+        offset = int(body.get("offset", 0))
+        page = records[offset : offset + int(body.get("limit", 100))]
+        return web.json_response({"status": "ok", "data": page})
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    fake = FakeRubitime(args.bookings, [int(c) for c in args.cooperators.split(",")], ZoneInfo(args.tz))
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    print(f"fake rubitime: http://127.0.0.1:{args.port}/api2 (rk={KEY}), {len(fake.records)} records")
+    try:
+        if args.churn > 0:
+            await fake.churn(args.churn, args.churn_interval)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--bookings", type=int, default=60)
+    parser.add_argument("--cooperators", default="101,102")
+    parser.add_argument("--tz", default="Europe/Moscow")
+    parser.add_argument("--churn", type=float, default=0.0, help="доля записей, меняющихся за интервал")
+    parser.add_argument("--churn-interval", type=float, default=10.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Нагрузочный прогон webhook-приложения: app.webhook_app:app поднимается отдельным процессом (uvicorn),
+исходящие вызовы Bot API уходят в локальную заглушку, а харнесс шлёт синтетические апдейты:
+пользователи встают в очередь и смотрят позицию, операторы вызывают следующего,
+«сканируют» QR через /api/confirm и завершают.
+
+    uv run python -m bench.load [--users 1000] [--operators 2] [--db-url sqlite:///bench.db]
+
+Нужен Redis (FSM-хранилище приложения): --redis-url, по умолчанию redis://localhost:6379/15.
+Для каждого вида апдейта печатаются p50/p95/p99 времени ответа webhook (ack) и полной обработки
+(от отправки апдейта до answerCallbackQuery в заглушке), в конце — апдейтов в секунду.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from itertools import count
+from urllib.parse import urlencode
+
+import httpx
+from aiohttp import web
+
+BOT_TOKEN = "123456:bench"
+WEBHOOK_SECRET = "bench-secret"
+OPERATOR_BASE_ID = 9_000_000
+USER_BASE_ID = 1_000_000
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def percentiles(values: list[float]) -> str:
+    return "/".join(f"{percentile(values, p):.1f}" for p in (50, 95, 99))
+
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API: отвечает ok на любой метод, запоминает сообщения по чатам
+    и сообщает харнессу о answerCallbackQuery — это конец обработки апдейта.
+    """
+
+    def __init__(self):
+        self.calls: Counter[str] = Counter()
+        self.messages: dict[int, list[str]] = defaultdict(list)
+        self.answered: dict[str, asyncio.Future] = {}
+        self._message_ids = count(1)
+        self._runner: web.AppRunner | None = None
+
+    def expect_answer(self, callback_id: str) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.answered[callback_id] = fut
+        return fut
+
+    async def start(self, port: int) -> None:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        form = await request.post()
+        result: object = True
+
+        if method in ("sendmessage", "sendphoto"):
+            chat_id = int(form["chat_id"])
+            self.messages[chat_id].append(str(form.get("text") or form.get("caption") or ""))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+        elif method == "answercallbackquery":
+            fut = self.answered.pop(str(form["callback_query_id"]), None)
+            if fut is not None and not fut.done():
+                fut.set_result(time.perf_counter())
+        elif method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+        return web.json_response({"ok": True, "result": result})
+
+
+class Harness:
+    def __init__(self, app_url: str, fake: FakeBotAPI, timeout: float):
+        self.client = httpx.AsyncClient(base_url=app_url, timeout=timeout)
+        self.fake = fake
+        self.timeout = timeout
+        self.update_ids = count(1)
+        self.ack: dict[str, list[float]] = defaultdict(list)
+        self.e2e: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.processed = 0
+
+    async def callback(self, kind: str, tg_user_id: int, data: str) -> bool:
+        """
+        Нажатие inline-кнопки от tg_user_id; True — апдейт обработан (пришёл answerCallbackQuery).
+        """
+        update_id = next(self.update_ids)
+        callback_id = f"cb{update_id}"
+        user = {"id": tg_user_id, "is_bot": False, "first_name": f"u{tg_user_id}"}
+        update = {
+            "update_id": update_id,
+            "callback_query": {
+                "id": callback_id,
+                "from": user,
+                "chat_instance": str(tg_user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": tg_user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "bench"},
+                    "text": "menu",
+                },
+            },
+        }
+        answered = self.fake.expect_answer(callback_id)
+        started = time.perf_counter()
+        try:
+            resp = await self.client.post(
+                "/tg/webhook", json=update, headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+            )
+        except httpx.HTTPError as e:
+            self.errors[f"{kind}: {type(e).__name__}"] += 1
+            self.fake.answered.pop(callback_id, None)
+            return False
+        self.ack[kind].append(time.perf_counter() - started)
+        if resp.status_code != 200:
+            self.errors[f"{kind}: HTTP {resp.status_code}"] += 1
+            self.fake.answered.pop(callback_id, None)
+            return False
+        try:
+            done_at = await asyncio.wait_for(answered, self.timeout)
+        except asyncio.TimeoutError:
+            self.errors[f"{kind}: no answer"] += 1
+            self.fake.answered.pop(callback_id, None)
+            return False
+        self.e2e[kind].append(done_at - started)
+        self.processed += 1
+        return True
+
+    async def confirm(self, operator_id: int, token: str) -> bool:
+        started = time.perf_counter()
+        resp = await self.client.post("/api/confirm", json={"token": token, "init_data": init_data(operator_id)})
+        elapsed = time.perf_counter() - started
+        self.ack["api_confirm"].append(elapsed)
+        self.e2e["api_confirm"].append(elapsed)
+        if resp.status_code != 200:
+            self.errors[f"api_confirm: HTTP {resp.status_code}"] += 1
+            return False
+        return True
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def init_data(tg_user_id: int) -> str:
+    """
+    initData WebApp оператора, подписанная так же, как это делает Telegram.
+    """
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"bench{tg_user_id}",
+        "user": json.dumps({"id": tg_user_id, "first_name": "op"}, separators=(",", ":")),
+    }
+    check = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+async def run_users(h: Harness, users: int, queues: int, concurrency: int) -> None:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        tg_id = USER_BASE_ID + i
+        async with slots:
+            if await h.callback("u:enq", tg_id, f"u:enq:{i % queues + 1}"):
+                await h.callback("u:pos", tg_id, "u:pos")
+
+    await asyncio.gather(*(one(i) for i in range(users)))
+
+
+async def run_operator(h: Harness, fake: FakeBotAPI, tokens, operator_id: int, queue_id: int) -> int:
+    served = 0
+    while True:
+        if not await h.callback("op:next", operator_id, f"op:next:{queue_id}"):
+            return served
+        text = fake.messages[operator_id][-1] if fake.messages[operator_id] else ""
+        m = re.search(r"#(\d+)", text)
+        if not m:
+            return served  # очередь пустая
+        # «сканер»: токен из QR берём прямо из БД
+        token = await tokens(int(m.group(1)))
+        if token and await h.confirm(operator_id, token):
+            await h.callback("op:serve", operator_id, f"op:serve:{queue_id}")
+            served += 1
+
+
+def token_reader(db_url: str):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from app.config import Settings
+
+    url = Settings(BOT_TOKEN=BOT_TOKEN, BASE_URL="http://bench", DB_URL=db_url).async_db_url
+    engine = create_async_engine(url)
+
+    async def read(ticket_id: int) -> str | None:
+        async with engine.connect() as conn:
+            row = (await conn.execute(text("SELECT confirm_token FROM ticket WHERE id = :id"), {"id": ticket_id})).first()
+        return row[0] if row else None
+
+    return read, engine
+
+
+def report(h: Harness, elapsed: float, fake: FakeBotAPI, health: dict) -> None:
+    print(f"\n{'kind':<12} {'n':>6}  {'ack p50/p95/p99, ms':>24}  {'e2e p50/p95/p99, ms':>24}")
+    for kind in h.ack:
+        ack = [v * 1000 for v in h.ack[kind]]
+        e2e = [v * 1000 for v in h.e2e[kind]]
+        print(f"{kind:<12} {len(ack):>6}  {percentiles(ack):>24}  {percentiles(e2e):>24}")
+    print(f"\nprocessed updates: {h.processed} in {elapsed:.2f}s -> {h.processed / elapsed:.1f} updates/s")
+    print("bot api calls:", dict(fake.calls))
+    if h.errors:
+        print("errors:", dict(h.errors))
+    print("app /health:", json.dumps(health, ensure_ascii=False))
+
+
+async def wait_ready(client: httpx.AsyncClient, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with code {proc.returncode}")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("app did not start in time")
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    db_url = args.db_url or f"sqlite:///{tempfile.mkdtemp(prefix='bench-')}/bench.db"
+    api_port, app_port = free_port(), free_port()
+    operators = [OPERATOR_BASE_ID + i for i in range(args.operators * args.queues)]
+
+    env = {
+        **os.environ,
+        "BOT_TOKEN": BOT_TOKEN,
+        "BASE_URL": f"http://127.0.0.1:{app_port}",
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "DB_URL": db_url,
+        "REDIS_URL": args.redis_url,
+        "OPERATOR_IDS": ",".join(map(str, operators)),
+        "QUEUE_ENGINE": args.queue_engine,
+    }
+    os.environ.update({k: env[k] for k in ("BOT_TOKEN", "BASE_URL", "DB_URL")})
+
+    fake = FakeBotAPI()
+    await fake.start(api_port)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.webhook_app:app", "--host", "127.0.0.1",
+         "--port", str(app_port), "--log-level", "warning"],
+        env=env,
+    )
+    h = Harness(f"http://127.0.0.1:{app_port}", fake, timeout=args.timeout)
+    tokens, engine = token_reader(db_url)
+    try:
+        await wait_ready(h.client, proc)
+        print(f"app ready, db={db_url}, users={args.users}, queues={args.queues}, operators/queue={args.operators}")
+
+        started = time.perf_counter()
+        await run_users(h, args.users, args.queues, args.concurrency)
+        print(f"enqueue phase: {time.perf_counter() - started:.2f}s")
+        served = await asyncio.gather(*(
+            run_operator(h, fake, tokens, op_id, i % args.queues + 1) for i, op_id in enumerate(operators)
+        ))
+        elapsed = time.perf_counter() - started
+        print(f"served: {sum(served)}")
+        health = (await h.client.get("/health")).json()
+        report(h, elapsed, fake, health)
+    finally:
+        await h.close()
+        await engine.dispose()
+        proc.terminate()
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        await fake.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--queues", type=int, default=2)
+    parser.add_argument("--operators", type=int, default=2, help="операторов на трассу")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных пользователей")
+    parser.add_argument("--db-url", default="", help="по умолчанию — временная SQLite")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--queue-engine", default="sql", choices=("sql", "redis"))
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Микробенчмарк рендера QR: исходный qrcode.make + PIL, PIL с подобранными box_size/border,
+собственный matrix-энкодер и повтор из кэша.
+
+    uv run python -m bench.qr_bench [-n 300]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from io import BytesIO
+from uuid import uuid4
+
+import qrcode
+
+from app.services.qr import qr_matrix, make_qr_png, render_matrix_png, render_pil_png
+
+
+def legacy_png(payload: str) -> bytes:
+    img = qrcode.make(payload)
+    bio = BytesIO()
+    img.save(bio, format="PNG")
+    return bio.getvalue()
+
+
+def bench(name: str, fn, payloads: list[str]) -> None:
+    start = time.perf_counter()
+    size = 0
+    for p in payloads:
+        size += len(fn(p))
+    elapsed = time.perf_counter() - start
+    n = len(payloads)
+    print(f"{name:<14} {elapsed / n * 1000:8.3f} ms/QR  {size // n:6d} B/QR")
+
+
+async def bench_cached(payloads: list[str]) -> None:
+    for p in payloads:
+        await make_qr_png(p)
+    start = time.perf_counter()
+    for p in payloads:
+        await make_qr_png(p)
+    elapsed = time.perf_counter() - start
+    print(f"{'cached':<14} {elapsed / len(payloads) * 1000:8.3f} ms/QR")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=300)
+    args = parser.parse_args()
+
+    payloads = [f"q:{i}:{uuid4().hex}" for i in range(args.n)]
+    bench("legacy", legacy_png, payloads)
+    bench("pil", render_pil_png, payloads)
+    bench("matrix", lambda p: render_matrix_png(qr_matrix(p)), payloads)
+    asyncio.run(bench_cached(payloads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Стресс-проверка переходов тикетов под конкуренцией: на одной трассе параллельно крутятся
+несколько циклов call_next, mark_no_show, confirm_by_token и serve_confirmed (каждый со своей
+сессией, как отдельные операторы). В конце проверяется, что каждый тикет вызван ровно один раз,
+завершён ровно одним способом (SERVED или NO_SHOW) и что итог в БД совпадает с увиденным.
+
+    BOT_TOKEN=1:x BASE_URL=https://example.org uv run python -m bench.stress_transitions \\
+        [--tickets 500] [--callers 8] [--no-show 2] [--servers 4] [--db-url sqlite:///stress.db]
+
+Ненулевой код выхода — нарушение инварианта. На SQLite записи сериализуются самой базой;
+гонки интереснее гонять на Postgres (--db-url postgresql://...).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+
+async def run(args: argparse.Namespace) -> int:
+    # настройки читаются при импорте app.config — импортируем после выставления DB_URL
+    from sqlmodel import select
+
+    from app.db import engine, get_session, init_db
+    from app.models import Ticket, TicketStatus
+    from app.services import queue as q
+
+    await init_db()
+    async with get_session() as session:
+        await q.list_queues(session)
+        queue = await q.create_queue(session, f"stress {int(time.time())}")
+        ticket_ids = []
+        for i in range(args.tickets):
+            user = await q.upsert_user(session, args.user_base + i, args.user_base + i, f"stress {i}")
+            # активный тикет с прошлого прерванного прогона помешал бы встать на новую трассу
+            await q.leave(session, user)
+            ticket = await q.enqueue(session, queue.id, user)
+            assert ticket is not None and ticket.queue_id == queue.id
+            ticket_ids.append(ticket.id)
+    print(f"queue {queue.id}: {len(ticket_ids)} tickets")
+
+    called: list[int] = []
+    no_show: list[int] = []
+    confirmed: list[int] = []
+    served: list[int] = []
+    tokens: asyncio.Queue[str] = asyncio.Queue()
+    calling_done = asyncio.Event()
+
+    async def caller(n: int) -> None:
+        while True:
+            async with get_session() as session:
+                ticket = await q.call_next(session, queue.id, operator_tg_id=n)
+            if ticket is None:
+                return
+            assert ticket.status == TicketStatus.CALLED, ticket
+            called.append(ticket.id)
+            # часть вызванных не приходит — их заберёт mark_no_show
+            if random.random() >= args.no_show_rate:
+                tokens.put_nowait(ticket.confirm_token)
+            await asyncio.sleep(0)
+
+    async def confirmer() -> None:
+        while not (calling_done.is_set() and tokens.empty()):
+            try:
+                token = await asyncio.wait_for(tokens.get(), 0.05)
+            except asyncio.TimeoutError:
+                continue
+            async with get_session() as session:
+                ticket = await q.confirm_by_token(session, token)
+            # None — тикет уже снят через mark_no_show: это тоже допустимый исход гонки
+            if ticket is not None:
+                confirmed.append(ticket.id)
+
+    async def drain(step, sink: list[int]) -> None:
+        idle = 0
+        while True:
+            async with get_session() as session:
+                ticket = await step(session, queue.id)
+            if ticket is not None:
+                sink.append(ticket.id)
+                idle = 0
+                continue
+            if calling_done.is_set() and tokens.empty():
+                idle += 1
+                if idle > 3:
+                    return
+            await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    callers = [asyncio.create_task(caller(n)) for n in range(args.callers)]
+    others = [asyncio.create_task(confirmer()) for _ in range(args.servers)]
+    others += [asyncio.create_task(drain(q.mark_no_show, no_show)) for _ in range(args.no_show)]
+    others += [asyncio.create_task(drain(q.serve_confirmed, served)) for _ in range(args.servers)]
+    await asyncio.gather(*callers)
+    calling_done.set()
+    await asyncio.gather(*others)
+    elapsed = time.perf_counter() - started
+
+    async with get_session() as session:
+        rows = (await session.exec(select(Ticket.id, Ticket.status).where(Ticket.queue_id == queue.id))).all()
+    await engine.dispose()
+    final = dict(rows)
+
+    errors = []
+
+    def check(ok: bool, message: str) -> None:
+        if not ok:
+            errors.append(message)
+
+    calls = Counter(called)
+    check(sorted(calls) == sorted(ticket_ids), f"called {len(calls)} of {len(ticket_ids)} tickets")
+    check(all(c == 1 for c in calls.values()), f"called twice: {[t for t, c in calls.items() if c > 1][:10]}")
+    check(len(set(confirmed)) == len(confirmed), "confirmed twice")
+    check(len(set(served)) == len(served), "served twice")
+    check(len(set(no_show)) == len(no_show), "no-show twice")
+    check(not set(served) & set(no_show), f"served and no-show: {sorted(set(served) & set(no_show))[:10]}")
+    check(set(served) <= set(confirmed), "served without confirmation")
+    finished = len(served) + len(no_show)
+    check(finished == len(ticket_ids), f"finished {finished} of {len(ticket_ids)}")
+    statuses = Counter(final.values())
+    db_served, db_no_show = statuses[TicketStatus.SERVED], statuses[TicketStatus.NO_SHOW]
+    check(db_served == len(served), f"db served {db_served} != {len(served)}")
+    check(db_no_show == len(no_show), f"db no-show {db_no_show} != {len(no_show)}")
+
+    print(
+        f"{elapsed:.2f}s: called {len(called)}, confirmed {len(confirmed)}, "
+        f"served {len(served)}, no-show {len(no_show)}; db {dict((s.value, n) for s, n in statuses.items())}"
+    )
+    for message in errors:
+        print("FAIL:", message)
+    return 1 if errors else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickets", type=int, default=500)
+    parser.add_argument("--callers", type=int, default=8)
+    parser.add_argument("--no-show", type=int, default=2, help="циклов mark_no_show")
+    parser.add_argument("--servers", type=int, default=4, help="циклов confirm_by_token и serve_confirmed")
+    parser.add_argument("--no-show-rate", type=float, default=0.2, help="доля вызванных, кто не подтвердит")
+    parser.add_argument("--user-base", type=int, default=8_000_000, help="первый tg id тестовых пользователей")
+    parser.add_argument("--db-url", default=None, help="по умолчанию — DB_URL из окружения")
+    args = parser.parse_args()
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()